@@ -1,36 +1,29 @@
 import random
-from decimal import Decimal
+import time
 
-piece_score = {"K": Decimal(0), "Q": Decimal('9.5'), "R": Decimal(5), "B": Decimal('3.3'), "N": Decimal(3),
-               "P": Decimal(1)}
-checkmate = 100
+from ChessBook import OpeningBook
+from ChessEngine import capture_order, move_from_id, move_squares_mask
+from ChessTablebase import TablebaseFile
+from ChessTransposition import TranspositionTable, exact, lower_bound, upper_bound
+
+# Scores are integer centipawns. The tables live in ChessEval so GameState can keep the score up to date itself.
+from ChessEval import piece_score
+
+checkmate = 100000
+mate_threshold = checkmate - 1000   # scores past this are a forced mate, checkmate minus the plies to it
 stalemate = 0
-DEPTH = 3
-next_move = None
-recursion_count = 0
-
-# This is denoting point value for pawns in certain positions. Value in terms of white in my view
-pawn_table = [
-            [0, 0, 0, 0, 0, 0, 0, 0],
-            [7, 7, 7, 7, 7, 7, 7, 7],
-            [4, 4, 4, 4, 4, 4, 4, 4],
-            [Decimal('1.5'), Decimal('1.5'), 2, 2, 2, 2, Decimal('1.5'), Decimal('1.5')],
-            [0, 0, Decimal('0.5'), 2, 2, Decimal('0.5'), 0, 0],
-            [Decimal('0.5'), 0, 0, 1, 1, 0, 0, Decimal('0.5')],
-            [Decimal('0.5'), Decimal('0.5'), 1, 1, 1, 1, Decimal('0.5'), Decimal('0.5')],
-            [0, 0, 0, 0, 0, 0, 0, 0]
-        ]
-
-knight_table = [
-        [0, 0, 0, 0, 0, 0, 0, 0],
-        [0, 0, 0, 0, 0, 0, 0, 0],
-        [0, Decimal('0.5'), 1, 2, 2, 1, Decimal('0.5'), 0],
-        [0, 0, 1, 2, 2, 1, 0, 0],
-        [0, 0, 1, 1, 1, 1, 0, 0],
-        [0, 0, 1, 1, 1, 1, 0, 0],
-        [0, 0, 0, 0, 0, 0, 0, 0],
-        [0, 0, 0, 0, 0, 0, 0, 0]
-    ]
+DEPTH = 3                   # depth searched when no time or node budget is given
+max_search_depth = 64
+aspiration_window = 50      # centipawns either side of the last iteration's score
+delta_margin = 200          # quiescence skips a capture that can not get within this much of alpha
+exchange_margin = 50        # quiescence skips a capture that loses more than this in the exchanges on its square
+null_move_min_depth = 3     # pvs_move tries a null move from this depth on
+late_move_count = 3         # pvs_move reduces quiet moves after this many have been searched
+default_strategy = 'pvs'    # key of search_strategies used when iterative_deepening is not given one
+transposition_table_mb = 16
+# Positions already searched, kept across searches. Made by get_transposition_table when the first search starts, so a
+# process that only imports this module (the game itself, which leaves searching to ChessWorker) never allocates it.
+transposition_table = None
 
 test = [
         [0, 0, 0, 0, 0, 0, 0, 0],
@@ -44,18 +37,183 @@ test = [
     ]
 
 
-table_dictionaries = {"P": pawn_table, "N": knight_table}
+# Killer moves and history scores for ordering quiet moves. A quiet move that caused a cutoff is likely to cause one
+# again in sibling positions (two killer slots per ply) and anywhere else in the tree (history, by from and to square
+# per side, weighted by depth squared so cutoffs near the root count most).
+class MoveOrdering:
+    history_limit = 1 << 20
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.killers = [[None, None] for _ in range(max_search_depth + 1)]
+        self.history = {'w': [0] * (move_squares_mask + 1), 'b': [0] * (move_squares_mask + 1)}
+
+    # Killers belong to the old root's plies. History is halved so the last search counts but does not dominate.
+    def new_search(self):
+        self.killers = [[None, None] for _ in range(max_search_depth + 1)]
+        for table in self.history.values():
+            for i in range(len(table)):
+                table[i] >>= 1
+
+    def moves(self, gamestate, hash_move, ply):
+        return gamestate.staged_moves(hash_move, self.killers[ply],
+                                      self.history['w' if gamestate.white_to_move else 'b'])
+
+    def cutoff(self, move, depth, ply):
+        if move.piece_captured != '--' or move.is_pawn_promotion:
+            return      # captures are already ordered by MVV-LVA
+        killers = self.killers[ply]
+        if killers[0] is None or killers[0].move_id != move.move_id:
+            killers[1] = killers[0]
+            killers[0] = move
+        table = self.history[move.piece_moved[0]]
+        index = move.move_id & move_squares_mask
+        table[index] += depth * depth
+        if table[index] >= self.history_limit:
+            for i in range(len(table)):
+                table[i] >>= 1
+
+
+move_ordering = MoveOrdering()
+
+
+class SearchStopped(Exception):
+    pass
+
+
+# Budget for one search. Any of movetime (seconds), max_nodes and max_depth can be set, the search ends at whichever
+# runs out first. With none of them it searches to DEPTH. stop_event (threading or multiprocessing Event) ends it
+# from outside. Time, nodes and the event are looked at every check_interval nodes.
+class SearchLimits:
+    check_interval = 1024
+
+    def __init__(self, movetime=None, max_nodes=None, max_depth=None, stop_event=None):
+        if max_depth is None:
+            max_depth = DEPTH if movetime is None and max_nodes is None else max_search_depth
+        self.movetime = movetime
+        self.max_nodes = max_nodes
+        self.max_depth = min(max_depth, max_search_depth)
+        self.stop_event = stop_event
+        self.deadline = None
+        self.nodes = 0
+        self.next_check = 0
+
+    def start(self):
+        self.deadline = time.perf_counter() + self.movetime if self.movetime is not None else None
+        self.nodes = 0
+        self.next_check = self.check_interval
+
+    # Called once per node. Raises SearchStopped when the budget is used up, the search unwinds to the last
+    # completed iteration.
+    def count_node(self):
+        self.nodes += 1
+        if self.nodes >= self.next_check:
+            self.next_check = self.nodes + self.check_interval
+            if self.out_of_budget():
+                raise SearchStopped
+
+    def out_of_budget(self):
+        return ((self.max_nodes is not None and self.nodes >= self.max_nodes)
+                or (self.deadline is not None and time.perf_counter() >= self.deadline)
+                or (self.stop_event is not None and self.stop_event.is_set()))
+
+
+# Opened Polyglot books by path. Each process maps a book once, the pages themselves are shared through the OS.
+opening_books = {}
+
+
+# A weighted random move from the Polyglot book at book_path, or None if the position is not in it
+def book_move(gamestate, book_path):
+    book = opening_books.get(book_path)
+    if book is None:
+        book = opening_books[book_path] = OpeningBook(book_path)
+    return book.weighted_choice(gamestate)
+
+
+# transposition_table, made now if this process has not searched before
+def get_transposition_table():
+    global transposition_table
+    if transposition_table is None:
+        transposition_table = TranspositionTable(transposition_table_mb)
+    return transposition_table
+
+
+# Endgame tablebases the search probes, a ChessTablebase.TablebaseFile or None. Opened by load_tablebases.
+tablebases = None
+
+
+# Opens the tablebase file at path for this process, keeping it open if it already is. None closes it.
+def load_tablebases(path):
+    global tablebases
+    if tablebases is not None and tablebases.path == path:
+        return tablebases
+    if tablebases is not None:
+        tablebases.close()
+    tablebases = TablebaseFile(path) if path is not None else None
+    return tablebases
+
+
+# Exact score of a position in the tablebases, mates counted from the root like the search's own, else None
+def tablebase_score(gamestate, ply):
+    result = tablebases.probe(gamestate)
+    if result is None:
+        return None
+    outcome, plies = result
+    if outcome > 0:
+        return checkmate - ply - plies
+    if outcome < 0:
+        return -checkmate + ply + plies
+    return stalemate
+
+
+# (move, score) picked by the tablebases alone, the fastest mate when winning and the longest defence when losing,
+# or None unless the position and every position after a move are in them
+def tablebase_move(gamestate, valid_moves):
+    if tablebases.probe(gamestate) is None:
+        return None
+    best_move, best_score = None, None
+    for move in valid_moves:
+        gamestate.make_move(move)
+        try:
+            score = tablebase_score(gamestate, 1)
+        finally:
+            gamestate.undo_move(False)
+        if score is None:
+            return None
+        if best_move is None or -score > best_score:
+            best_move, best_score = move, -score
+    return best_move, best_score
+
+
+# Entry point for the AI process. The position comes over as GameState.get_snapshot() bytes instead of a pickled
+# GameState, game_class (GameState or BitboardGameState) rebuilds it and finder searches it as usual. With a
+# book_path the opening book is asked first and the search only runs once the game has left it. With a
+# tablebase_path the search uses those endgame tablebases.
+def find_move_from_snapshot(finder, game_class, snapshot, return_queue, limits=None, book_path=None,
+                            tablebase_path=None):
+    gamestate = game_class.from_snapshot(snapshot)
+    if tablebase_path is not None:
+        load_tablebases(tablebase_path)
+    if book_path is not None:
+        move = book_move(gamestate, book_path)
+        if move is not None:
+            return_queue.put(move)
+            return
+    finder(gamestate, gamestate.get_valid_moves(), return_queue, limits)
 
 
 def find_random_move(valid_moves):
     return valid_moves[random.randint(0, len(valid_moves)-1)]        # returns number between a and b including a and b
 
 
-# Non-recursive
-def find_best_move(gamestate, valid_moves, return_queue):
+# Non-recursive. Two plies are quick enough that limits is only taken so both finders are called the same way.
+def find_best_move(gamestate, valid_moves, return_queue, limits=None):
     turn_value = 1 if gamestate.white_to_move else -1
     minimax_score = checkmate
     best_move = None
+    valid_moves = valid_moves[:]                    # the list is shared with the legal move cache
     random.shuffle(valid_moves)                     # Randomly shuffle moves.
     for player_move in valid_moves:
         gamestate.make_move(player_move)
@@ -91,123 +249,329 @@ def find_best_move(gamestate, valid_moves, return_queue):
     return_queue.put(best_move)
 
 
-def find_best_move_minimax(gamestate, valid_moves):
-    global next_move, recursion_count
-    next_move = None
-    recursion_count = 0             # for debugging
-    random.shuffle(valid_moves)
-    # minimax_move(gamestate, valid_moves, DEPTH, gamestate.white_to_move)
-    negamax_move(gamestate, valid_moves, DEPTH, 1 if gamestate.white_to_move else -1)
-    print(recursion_count)
-    return next_move
-
-
-def find_best_move_minimax(gamestate, valid_moves, return_queue):
-    global next_move, recursion_count
-    next_move = None
-    # recursion_count = 0             # for debugging
-    random.shuffle(valid_moves)
-    # minimax_move(gamestate, valid_moves, DEPTH, gamestate.white_to_move)
-    negamax_move(gamestate, valid_moves, DEPTH, 1 if gamestate.white_to_move else -1)
-    # print(recursion_count)
-    return_queue.put(next_move)
-
-
-def minimax_move(gamestate, valid_moves, depth, white_to_move, alpha=-1000, beta=1000):
-    global next_move
-    if depth == 0:
-        return score_board(gamestate)
-    search = 0
-    min_move_search = 5
-    # This is so it will check at least a couple as not ordered therefore can exist a better move
-
-    if white_to_move:
-        max_score = -checkmate  # worst score possible
-        for move in valid_moves:
-            gamestate.make_move(move)
-            new_valid_moves = gamestate.get_valid_moves()
-            # switch beta and alpha because we are looking in the opponent view
-            score = minimax_move(gamestate, new_valid_moves, depth - 1, False, beta, alpha)
-            alpha = max(alpha, score)
-            search += 1
-            if score > max_score:
-                max_score = score
-                if depth == DEPTH:
-                    next_move = move
-            elif score == max_score:  # Randomly change move if they have same value
-                if random.randint(0, 9) < 3:
-                    if depth == DEPTH:
-                        next_move = move
-            if alpha >= beta and search >= min_move_search:  # if max is > minimum, no more reason to look in this tree.
-                gamestate.undo_move(False)
-                break
-
+def find_best_move_minimax(gamestate, valid_moves, return_queue, limits=None):
+    return_queue.put(iterative_deepening(gamestate, valid_moves, limits)[0])
+
+
+# Searches depth 1, 2, 3, ... until limits runs out and returns (best move, score, depth) of the last completed
+# iteration, score from the side to move's view. report(depth, score, move, nodes) is called after every completed
+# iteration, so a caller always has a move in hand. Depth 1 is always finished, the budget can not stop it.
+# strategy picks the search from search_strategies, default_strategy if None. A seed makes the order of equal root
+# moves repeatable, so a depth or node limited search always gives the same move. A position the tablebases solve is
+# answered from them without searching, with depth 0.
+def iterative_deepening(gamestate, valid_moves=None, limits=None, report=None, strategy=None, seed=None):
+    search = search_strategies[strategy or default_strategy]
+    if limits is None:
+        limits = SearchLimits()
+    if valid_moves is None:
+        valid_moves = gamestate.get_valid_moves()
+    if not valid_moves:
+        return None, -checkmate if gamestate.in_check() else stalemate, 0
+    if tablebases is not None:
+        solved = tablebase_move(gamestate, valid_moves)
+        if solved is not None:
+            return solved[0], solved[1], 0
+    get_transposition_table().new_search()
+    move_ordering.new_search()
+    limits.start()
+    moves = valid_moves[:]          # the list is shared with the legal move cache
+    # equal moves are played in a different order every game
+    (random.Random(seed) if seed is not None else random).shuffle(moves)
+    # Captures by MVV-LVA first, quiet moves after them in their shuffled order
+    moves.sort(key=lambda move: capture_order(move) if move.piece_captured != '--' or move.is_pawn_promotion else -8,
+               reverse=True)
+    best_move, best_score, completed = moves[0], 0, 0
+    for depth in range(1, limits.max_depth + 1):
+        # Start with a narrow window around the last score and widen the side that failed until the score fits
+        if depth >= 3 and abs(best_score) < mate_threshold:
+            delta = aspiration_window
+            alpha, beta = best_score - delta, best_score + delta
+        else:
+            delta = None
+            alpha, beta = -10 * checkmate, 10 * checkmate
+        try:
+            while True:
+                score, move = search_root(gamestate, moves, depth, alpha, beta, limits if depth > 1 else None, search)
+                if delta is not None and score <= alpha:
+                    delta *= 4
+                    alpha = max(score - delta, -10 * checkmate)
+                elif delta is not None and score >= beta:
+                    delta *= 4
+                    beta = min(score + delta, 10 * checkmate)
+                else:
+                    break
+        except SearchStopped:
+            break
+        best_move, best_score, completed = move, score, depth
+        moves.remove(move)
+        moves.insert(0, move)       # the best move so far is searched first next iteration
+        if report is not None:
+            report(depth, score, move, limits.nodes)
+        if abs(score) >= mate_threshold or limits.out_of_budget():
+            break
+    return best_move, best_score, completed
+
+
+# One iteration at the root. Returns (score, best move) for the window, the first move searched if none beat alpha.
+# With pvs_move every move after the first is only tested against alpha, and searched again in full if it beats it.
+def search_root(gamestate, moves, depth, alpha, beta, limits=None, search=None):
+    if search is None:
+        search = negamax_move
+    alpha_start = alpha
+    best_score = -10 * checkmate
+    best_move = moves[0]
+    for move in moves:
+        gamestate.make_move(move)
+        try:
+            if search is pvs_move and move is not moves[0]:
+                score = -search(gamestate, depth - 1, 1, -alpha - 1, -alpha, limits)
+                if alpha < score < beta:
+                    score = -search(gamestate, depth - 1, 1, -beta, -alpha, limits)
+            else:
+                score = -search(gamestate, depth - 1, 1, -beta, -alpha, limits)
+        finally:
             gamestate.undo_move(False)
-        return max_score
+        if score > best_score:
+            best_score = score
+            best_move = move
+        if score > alpha:
+            alpha = score
+        if alpha >= beta:
+            break
+    if best_score <= alpha_start:
+        bound = upper_bound
+    elif best_score >= beta:
+        bound = lower_bound
     else:
-        min_score = checkmate
-        for move in valid_moves:
-            gamestate.make_move(move)
-            new_valid_moves = gamestate.get_valid_moves()
-            # switch beta and alpha because we are looking in the opponent view
-            score = minimax_move(gamestate, new_valid_moves, depth - 1, True, beta, alpha)
-            beta = min(beta, score)
-            search += 1
-            if score < min_score:
-                min_score = score
-                if depth == DEPTH:
-                    next_move = move
-            elif score == min_score:  # Randomly consider changing move if they have same value
-                if random.randint(0, 9) < 3:
-                    if depth == DEPTH:
-                        next_move = move
-            if alpha <= beta and search >= min_move_search:  # if min is > maximum, no more reason to look in this tree.
-                gamestate.undo_move(False)
-                break
-
-            gamestate.undo_move(False)
-        return min_score
+        bound = exact
+    transposition_table.store(gamestate.zobrist_key, depth, bound, best_score, best_move.move_id)
+    return best_score, best_move
 
 
 # General Flow: Continue until depth 0, find best possible score to the first response to a player's move
 # EX: 3. Black -> 2. White -> 1. Black Search all moves and find best answer to White's move
 # At 2nd White Responses, if white can 'beat' this number, as >= is worst for black so no need to check others
 # It will then use these values to find white's possible best response to Black's initial move, repeating.
-def negamax_move(gamestate, valid_moves, depth, turn_multiplier, alpha=-1000, beta=1000):
-    global next_move, recursion_count
-    search = 0
-    min_move_search = 7
-    # This is here because my sorting is terrible so quite a likely chance for better move to exist
-    recursion_count += 1    # for debugging
+# Scores are from the side to move's view, ply counts moves from the root so nearer mates score higher.
+def negamax_move(gamestate, depth, ply, alpha=-10 * checkmate, beta=10 * checkmate, limits=None):
     if depth == 0:
-        return turn_multiplier * score_board(gamestate)
+        return quiescence(gamestate, ply, alpha, beta, limits)
+    if limits is not None:
+        limits.count_node()
+    if gamestate.is_repetition() or gamestate.halfmove_clock >= 100:
+        return stalemate
+    if tablebases is not None:
+        score = tablebase_score(gamestate, ply)
+        if score is not None:
+            return score
+    # A stored result from at least this depth answers the node outright if its bound fits the window
+    key = gamestate.zobrist_key
+    entry = transposition_table.probe(key)
+    hash_move = None
+    if entry is not None:
+        entry_depth, bound, score, move_id = entry
+        score = score_from_table(score, ply)
+        if entry_depth >= depth and (bound == exact or (bound == lower_bound and score >= beta)
+                                     or (bound == upper_bound and score <= alpha)):
+            return score
+        if move_id:
+            hash_move = move_from_id(move_id, gamestate.board)
+    alpha_start = alpha
     max_score = -checkmate
-    for move in valid_moves:
-        gamestate.make_move(move)
-        new_valid_moves = gamestate.get_valid_moves()
-        # it will always search from top left to bottom right piece of a color's pieces
-        random.shuffle(new_valid_moves)
+    best_move = None
+    legal_moves = 0
+    # Moves come lazily from the staged generator (hash move, captures by MVV-LVA, killers, then quiet moves by
+    # history) and are only checked for legality when played, so a cutoff skips building the rest of the list.
+    for move in move_ordering.moves(gamestate, hash_move, ply):
+        if not gamestate.make_legal_move(move):
+            continue
+        legal_moves += 1
         # switch beta and alpha because we are looking in the opponent view
-        score = -negamax_move(gamestate, new_valid_moves, depth - 1, -turn_multiplier, -beta, -alpha)
+        try:
+            score = -negamax_move(gamestate, depth - 1, ply + 1, -beta, -alpha, limits)
+        finally:
+            gamestate.undo_move(False)
         alpha = max(alpha, score)       # Maximum of all moves
-        search += 1
-        if score >= max_score:
+        if score > max_score or best_move is None:
             max_score = score
-            if depth == DEPTH:
-                if score > max_score:
-                    next_move = move
-                else:
-                    if random.randint(0, 9) < 3:    # Randomly consider changing move if they have same value
-                        next_move = move
+            best_move = move
         # if max is > minimum, no more reason to look in this tree.
-        if alpha >= beta and search >= min_move_search:
-            gamestate.undo_move(False)
+        if alpha >= beta:
+            move_ordering.cutoff(move, depth, ply)
             break
+    if legal_moves == 0:    # no legal move at all, mated or stalemated
+        max_score = -checkmate + ply if gamestate.in_check() else stalemate
+    if max_score <= alpha_start:
+        bound = upper_bound
+    elif max_score >= beta:
+        bound = lower_bound
+    else:
+        bound = exact
+    transposition_table.store(key, depth, bound, score_to_table(max_score, ply),
+                              best_move.move_id if best_move is not None else 0)
+    return max_score
 
-        gamestate.undo_move(False)
+
+# Principal variation search. The first move is searched with the full window, the others only with a zero window
+# around alpha to prove they are no better, and searched again in full when one is. On top of that:
+# - null move: a side that is still at or above beta after passing the turn is not searched further (never in check,
+#   on the PV, twice in a row, or with only pawns left, where passing can be the only bad move)
+# - late move reductions: quiet moves late in the ordering are searched shallower first and again at full depth
+#   only if they beat alpha
+def pvs_move(gamestate, depth, ply, alpha=-10 * checkmate, beta=10 * checkmate, limits=None, null_allowed=True):
+    if depth <= 0:
+        return quiescence(gamestate, ply, alpha, beta, limits)
+    if limits is not None:
+        limits.count_node()
+    if gamestate.is_repetition() or gamestate.halfmove_clock >= 100:
+        return stalemate
+    if tablebases is not None:
+        score = tablebase_score(gamestate, ply)
+        if score is not None:
+            return score
+    pv_node = beta - alpha > 1
+    key = gamestate.zobrist_key
+    entry = transposition_table.probe(key)
+    hash_move = None
+    if entry is not None:
+        entry_depth, bound, score, move_id = entry
+        score = score_from_table(score, ply)
+        if not pv_node and entry_depth >= depth and (bound == exact or (bound == lower_bound and score >= beta)
+                                                     or (bound == upper_bound and score <= alpha)):
+            return score
+        if move_id:
+            hash_move = move_from_id(move_id, gamestate.board)
+    in_check = gamestate.in_check()
+    color = 'w' if gamestate.white_to_move else 'b'
+    if (null_allowed and not pv_node and not in_check and depth >= null_move_min_depth
+            and (1 if gamestate.white_to_move else -1) * gamestate.eval_score >= beta
+            and gamestate.has_non_pawn_material(color)):
+        reduction = 3 if depth > 6 else 2
+        enpassant = gamestate.make_null_move()
+        try:
+            score = -pvs_move(gamestate, depth - 1 - reduction, ply + 1, -beta, -beta + 1, limits, False)
+        finally:
+            gamestate.undo_null_move(enpassant)
+        if score >= beta:
+            return beta if score >= mate_threshold else score    # an unproven mate is not stored as one
+    alpha_start = alpha
+    max_score = -checkmate
+    best_move = None
+    legal_moves = 0
+    killers = move_ordering.killers[ply]
+    for move in move_ordering.moves(gamestate, hash_move, ply):
+        if not gamestate.make_legal_move(move):
+            continue
+        legal_moves += 1
+        try:
+            if legal_moves == 1:
+                score = -pvs_move(gamestate, depth - 1, ply + 1, -beta, -alpha, limits)
+            else:
+                reduction = 0
+                if (depth >= 3 and legal_moves > late_move_count and not in_check
+                        and move.piece_captured == '--' and not move.is_pawn_promotion
+                        and move not in killers and not gamestate.in_check()):
+                    reduction = 2 if legal_moves > 3 * late_move_count else 1
+                score = -pvs_move(gamestate, depth - 1 - reduction, ply + 1, -alpha - 1, -alpha, limits)
+                if score > alpha and reduction:
+                    score = -pvs_move(gamestate, depth - 1, ply + 1, -alpha - 1, -alpha, limits)
+                if alpha < score < beta:
+                    score = -pvs_move(gamestate, depth - 1, ply + 1, -beta, -alpha, limits)
+        finally:
+            gamestate.undo_move(False)
+        if score > max_score or best_move is None:
+            max_score = score
+            best_move = move
+        if score > alpha:
+            alpha = score
+            if alpha >= beta:
+                move_ordering.cutoff(move, depth, ply)
+                break
+    if legal_moves == 0:
+        max_score = -checkmate + ply if in_check else stalemate
+    if max_score <= alpha_start:
+        bound = upper_bound
+    elif max_score >= beta:
+        bound = lower_bound
+    else:
+        bound = exact
+    transposition_table.store(key, depth, bound, score_to_table(max_score, ply),
+                              best_move.move_id if best_move is not None else 0)
     return max_score
 
 
+search_strategies = {'negamax': negamax_move, 'pvs': pvs_move}
+
+
+# At the horizon only captures and queen promotions are searched, until the position is quiet, so an exchange is
+# never scored halfway through. The side to move can stand pat on the static score instead of capturing. A capture
+# that could not bring the score near alpha even with delta_margin to spare is skipped, and so is one that loses more
+# than exchange_margin once the recaptures on its square are played out (static exchange), so roughly even trades
+# like BxN are still searched. In check every evasion is searched and there is no standing pat, so mates on the
+# horizon are still seen.
+def quiescence(gamestate, ply, alpha, beta, limits=None):
+    if limits is not None:
+        limits.count_node()
+    in_check = gamestate.in_check()
+    if in_check:
+        best_score = -checkmate + ply
+        moves = gamestate.get_pseudo_legal_moves()
+        moves.sort(key=capture_order, reverse=True)
+    else:
+        best_score = (1 if gamestate.white_to_move else -1) * gamestate.eval_score
+        if best_score >= beta:
+            return best_score
+        alpha = max(alpha, best_score)
+        moves = gamestate.get_capture_moves()
+        moves.sort(key=capture_order, reverse=True)
+    for move in moves:
+        if not in_check:
+            if move.is_pawn_promotion and move.promotion_piece != 'Q':
+                continue
+            gain = piece_score[move.piece_captured[1]] if move.piece_captured != '--' else 0
+            if move.is_pawn_promotion:
+                gain += piece_score['Q'] - piece_score['P']
+            if best_score + gain + delta_margin <= alpha:
+                continue
+            # Losing exchanges are what blows up the tree in busy positions. Only a more valuable piece taking on a
+            # defended square can lose anything, so the exchange is only worked out for those, and what it really
+            # gains gets the same delta test as above.
+            if piece_score[move.piece_moved[1]] > gain and gamestate.king_attacked(move.end_row, move.end_col):
+                exchange = gamestate.static_exchange(move)
+                if exchange < -exchange_margin or best_score + exchange + delta_margin <= alpha:
+                    continue
+        if not gamestate.make_legal_move(move):
+            continue
+        try:
+            score = -quiescence(gamestate, ply + 1, -beta, -alpha, limits)
+        finally:
+            gamestate.undo_move(False)
+        if score > best_score:
+            best_score = score
+            if score > alpha:
+                alpha = score
+                if alpha >= beta:
+                    break
+    return best_score
+
+
+# Mate scores go into the table as distance from the stored position, not from the root it was searched under
+def score_to_table(score, ply):
+    if score >= mate_threshold:
+        return score + ply
+    if score <= -mate_threshold:
+        return score - ply
+    return score
+
+
+def score_from_table(score, ply):
+    if score >= mate_threshold:
+        return score - ply
+    if score <= -mate_threshold:
+        return score + ply
+    return score
+
+
 # this will track importance of location instead of just material.
 def score_board(gamestate):
     if gamestate.checkmate:
@@ -217,20 +581,8 @@ def score_board(gamestate):
             return checkmate    # white wins
     elif gamestate.stalemate:
         return stalemate
-    score = 0
-
-    for row in range(len(gamestate.board)):
-        for square in range(len(gamestate.board)):
-            if gamestate.board[row][square][0] == 'w':  # White is advantage at positive
-                score += piece_score[gamestate.board[row][square][1]]
-                if gamestate.board[row][square][1] in table_dictionaries:
-                    score += table_dictionaries[gamestate.board[row][square][1]][row][square]
-            elif gamestate.board[row][square][0] == 'b':  # Black is advantage at negative
-                score -= piece_score[gamestate.board[row][square][1]]
-                if gamestate.board[row][square][1] in table_dictionaries:
-                    score -= table_dictionaries[gamestate.board[row][square][1]][::-1][row][square]
-
-    return score
+    # Material and tables are kept up to date by GameState on every board write
+    return gamestate.eval_score
 
 
 def score_material(board):
@@ -0,0 +1,67 @@
+# Batch evaluation with NumPy for analytics and tuning jobs. Positions are rows of an (N, 64) int8 array of
+# ChessEngine.piece_codes, square index row * 8 + col, and the material + piece-square score (GameState.eval_score)
+# is worked out for all rows at once. NumPy is only needed for this module, the game and the AI do not import it.
+#
+# codes = ChessBatch.encode_boards(gamestate for gamestate, _ in ChessFen.read_game_states("positions.epd"))
+# scores = ChessBatch.evaluate_boards(codes)      # white's view, same numbers as score_board for ongoing games
+
+import numpy as np
+
+import ChessEngine
+import ChessEval
+
+# A square's two characters ("wP", "--") read as one little-endian uint16 pick its piece code from this table
+_code_lookup = np.zeros(1 << 16, dtype=np.int8)
+for _piece, _code in ChessEngine.piece_codes.items():
+    _code_lookup[ord(_piece[0]) | ord(_piece[1]) << 8] = _code
+
+
+# [piece code, square] -> centipawns of that piece there from white's view, the same values GameState.eval_score
+# is summed from
+def build_weights():
+    weights = np.zeros((len(ChessEngine.piece_names), 64), dtype=np.int32)
+    for code in range(1, len(ChessEngine.piece_names)):
+        weights[code] = ChessEval.piece_square_values[ChessEngine.piece_names[code]]
+    return weights
+
+
+weights = build_weights()
+_flat_weights = weights.reshape(-1)
+_square_offsets = np.arange(64, dtype=np.intp)
+
+
+# (N, 64) int8 piece codes for any iterable of GameStates. Each board is joined into one string, the per-square work
+# happens in NumPy. Reused GameStates (ChessFen.read_game_states) are fine, every board is read before the next one.
+def encode_boards(gamestates):
+    return _codes_from_rows([''.join(gamestate.squares) for gamestate in gamestates])
+
+
+def _codes_from_rows(rows):
+    if not rows:
+        return np.zeros((0, 64), dtype=np.int8)
+    return _code_lookup[np.frombuffer(''.join(rows).encode('ascii'), dtype='<u2')].reshape(-1, 64)
+
+
+# One board the other way round, for checking a row by eye or loading it back with GameState.load_fen
+def decode_board(codes):
+    return [[ChessEngine.piece_names[codes[r * 8 + c]] for c in range(8)] for r in range(8)]
+
+
+# Material and piece-square score of every row, from white's view. Checkmate and stalemate are not looked at.
+def evaluate_boards(codes):
+    codes = np.asarray(codes)
+    if codes.ndim != 2 or codes.shape[1] != 64:
+        raise ValueError("Expected an (N, 64) array of piece codes, got shape " + str(codes.shape))
+    return _flat_weights[codes.astype(np.intp) * 64 + _square_offsets].sum(axis=1)
+
+
+# Scores a stream of GameStates batch_size boards at a time, so memory stays flat on big files. Yields score arrays.
+def evaluate_game_states(gamestates, batch_size=65536):
+    batch = []
+    for gamestate in gamestates:
+        batch.append(''.join(gamestate.squares))
+        if len(batch) == batch_size:
+            yield evaluate_boards(_codes_from_rows(batch))
+            batch = []
+    if batch:
+        yield evaluate_boards(_codes_from_rows(batch))
@@ -0,0 +1,662 @@
+# Bitboard backend for GameState. The position is twelve 64-bit piece sets plus one set per color and the occupancy,
+# and make_move / undo_move only flip bits in those, the zobrist key and the score. There are no attack maps and no
+# per-piece square sets: attacks, checks and pins are worked out from the sets when they are asked for, sliders
+# through lookup tables keyed by the blockers on their lines. GameState's board and squares lists are still written
+# as a plain mailbox (what stands on a square), because Move objects, FEN, snapshots and the UI read them.
+#
+# Same API as GameState, so ChessAI, ChessParallel, ChessWorker and main.py take either class. The search's
+# staged_moves is GameState's, its stages (find_move, get_capture_moves, get_quiet_moves) come from here.
+#
+# gamestate = ChessBitboard.BitboardGameState()       # or BitboardGameState(fen), BitboardGameState.from_snapshot(data)
+
+from ChessEngine import GameState, pieces, pooled_move, move_pool, piece_codes, move_enpassant_flag, \
+    move_castle_flag, promotion_pieces, promotion_shift, zobrist_pieces, zobrist_castle, zobrist_black_to_move, \
+    enpassant_squares
+from ChessEval import piece_score, piece_square_values
+
+# Square index is row * 8 + col, so bit 0 is a8 and bit 63 is h1. Same orientation as GameState.board.
+full_board = (1 << 64) - 1
+file_a = sum(1 << (r * 8) for r in range(8))
+not_file_a = full_board ^ file_a
+not_file_h = full_board ^ (file_a << 7)
+rank_masks = [0xFF << (r * 8) for r in range(8)]        # by row
+promotion_rows = {'w': rank_masks[0], 'b': rank_masks[7]}
+# Pieces of a color, least valuable first (the order static_exchange takes them in)
+color_pieces = {'w': ('wP', 'wN', 'wB', 'wR', 'wQ', 'wK'), 'b': ('bP', 'bN', 'bB', 'bR', 'bQ', 'bK')}
+opponent = {'w': 'b', 'b': 'w'}
+promotion_flags = tuple(i << promotion_shift for i in range(1, len(promotion_pieces)))
+# zobrist_pieces by square index instead of [row][col]
+square_keys = {piece: [zobrist_pieces[piece][sq >> 3][sq & 7] for sq in range(64)] for piece in pieces}
+# Castle rights (Castle.bits()) that survive a move from or to each square: king and rook squares take theirs away
+castle_keep = [15] * 64
+castle_keep[60], castle_keep[63], castle_keep[56] = 12, 14, 13
+castle_keep[4], castle_keep[7], castle_keep[0] = 3, 11, 7
+# Rook start and end square of a castle move, by the king's end square
+castle_rook_squares = {62: (63, 61), 58: (56, 59), 6: (7, 5), 2: (0, 3)}
+
+
+def square_bit(r, c):
+    return 1 << (r * 8 + c)
+
+
+def _jump_table(offsets):
+    table = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        mask = 0
+        for dr, dc in offsets:
+            if 0 <= r + dr <= 7 and 0 <= c + dc <= 7:
+                mask |= square_bit(r + dr, c + dc)
+        table.append(mask)
+    return table
+
+
+def _ray_table(dr, dc):
+    table = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        mask = 0
+        r, c = r + dr, c + dc
+        while 0 <= r <= 7 and 0 <= c <= 7:
+            mask |= square_bit(r, c)
+            r, c = r + dr, c + dc
+        table.append(mask)
+    return table
+
+
+knight_attacks = _jump_table(((-2, -1), (-2, 1), (2, -1), (2, 1), (-1, 2), (-1, -2), (1, 2), (1, -2)))
+king_attacks = _jump_table(((-1, -1), (-1, 1), (1, 1), (1, -1), (-1, 0), (0, 1), (1, 0), (0, -1)))
+# Squares a pawn of that color attacks from a square. White pawns move up the board (row - 1).
+pawn_attacks = {'w': _jump_table(((-1, -1), (-1, 1))), 'b': _jump_table(((1, -1), (1, 1)))}
+
+# (ray table, True if the ray goes towards higher square numbers). The first blocker on a positive ray is the
+# lowest set bit, on a negative ray the highest set bit.
+rook_rays = ((_ray_table(0, 1), True), (_ray_table(1, 0), True), (_ray_table(0, -1), False), (_ray_table(-1, 0), False))
+bishop_rays = ((_ray_table(1, 1), True), (_ray_table(1, -1), True), (_ray_table(-1, -1), False),
+               (_ray_table(-1, 1), False))
+
+
+def slider_attacks(sq, occupied, rays):
+    attacks = 0
+    for ray_table, positive in rays:
+        ray = ray_table[sq]
+        blockers = ray & occupied
+        if blockers:
+            if positive:
+                first = (blockers & -blockers).bit_length() - 1
+            else:
+                first = blockers.bit_length() - 1
+            ray ^= ray_table[first]     # cut off everything behind the first blocker
+        attacks |= ray
+    return attacks
+
+
+# Squares whose pieces can change a slider's attacks: its rays without the last square, which is attacked either way
+def _blocker_masks(rays):
+    masks = []
+    for sq in range(64):
+        mask = 0
+        for ray_table, positive in rays:
+            ray = ray_table[sq]
+            if ray:
+                last = ray.bit_length() - 1 if positive else (ray & -ray).bit_length() - 1
+                mask |= ray ^ (1 << last)
+        masks.append(mask)
+    return masks
+
+
+rook_blockers = _blocker_masks(rook_rays)
+bishop_blockers = _blocker_masks(bishop_rays)
+# Attacks by square and blockers on the slider's lines. Filled in the first time a pattern comes up rather than all
+# ~107k at import, the same few patterns come back all through a search. At most 4096 entries per square.
+rook_table = [{} for _ in range(64)]
+bishop_table = [{} for _ in range(64)]
+
+
+def rook_attacks(sq, occupied):
+    blockers = occupied & rook_blockers[sq]
+    attacks = rook_table[sq].get(blockers)
+    if attacks is None:
+        attacks = rook_table[sq][blockers] = slider_attacks(sq, blockers, rook_rays)
+    return attacks
+
+
+def bishop_attacks(sq, occupied):
+    blockers = occupied & bishop_blockers[sq]
+    attacks = bishop_table[sq].get(blockers)
+    if attacks is None:
+        attacks = bishop_table[sq][blockers] = slider_attacks(sq, blockers, bishop_rays)
+    return attacks
+
+
+# Squares strictly between two squares on one line, 0 if they do not share a rank, file or diagonal
+def _between_table():
+    table = [[0] * 64 for _ in range(64)]
+    for sq in range(64):
+        for dr in (-1, 0, 1):
+            for dc in (-1, 0, 1):
+                if dr == 0 and dc == 0:
+                    continue
+                r, c = divmod(sq, 8)
+                line = 0
+                r, c = r + dr, c + dc
+                while 0 <= r <= 7 and 0 <= c <= 7:
+                    table[sq][r * 8 + c] = line
+                    line |= square_bit(r, c)
+                    r, c = r + dr, c + dc
+    return table
+
+
+between = _between_table()
+
+
+# pooled_move by square index, looked up in the same pool without going through rows and columns
+def square_move(start, end, squares, board, flags=0):
+    move = move_pool.get(start | end << 6 | flags | piece_codes[squares[start]] << 17 | piece_codes[squares[end]] << 21)
+    if move is None:
+        move = pooled_move(start >> 3, start & 7, end >> 3, end & 7, board, flags)
+    return move
+
+
+class BitboardGameState(GameState):
+    # Built instead of GameState's square sets: the piece and color sets, the occupancy, the squares mailbox and
+    # eval_score, all from self.board. Only needed when the board is replaced wholesale.
+    def compute_piece_squares(self):
+        self.squares = [piece for row in self.board for piece in row]
+        self.piece_boards = {piece: 0 for piece in pieces}
+        self.color_boards = {'w': 0, 'b': 0}
+        self.eval_score = 0
+        for sq in range(64):
+            piece = self.squares[sq]
+            if piece != '--':
+                self.piece_boards[piece] |= 1 << sq
+                self.color_boards[piece[0]] |= 1 << sq
+                self.eval_score += piece_square_values[piece][sq]
+        self.occupied = self.color_boards['w'] | self.color_boards['b']
+
+    # No attack maps, attacks come from the sets when they are asked for
+    def compute_attack_counts(self):
+        self.attack_counts = None
+
+    # One square write for callers outside make_move / undo_move, which flip their bits themselves
+    def set_square(self, r, c, piece):
+        sq = r * 8 + c
+        old = self.squares[sq]
+        bit = 1 << sq
+        if old != '--':
+            self.piece_boards[old] ^= bit
+            self.color_boards[old[0]] ^= bit
+            self.zobrist_key ^= square_keys[old][sq]
+        if piece != '--':
+            self.piece_boards[piece] |= bit
+            self.color_boards[piece[0]] |= bit
+            self.zobrist_key ^= square_keys[piece][sq]
+        self.eval_score += piece_square_values[piece][sq] - piece_square_values[old][sq]
+        self.squares[sq] = piece
+        self.board[r][c] = piece
+        self.occupied = self.color_boards['w'] | self.color_boards['b']
+
+    def make_move(self, move):
+        if self.undo_count == len(self.undo_stack):
+            self.undo_stack.extend([0] * len(self.undo_stack))
+        self.undo_stack[self.undo_count] = self.undo_entry(move)
+        self.undo_count += 1
+        rights = self.castle_rights.bits()
+        # the old en passant and castle rights come out of the key, the new ones go back in at the end
+        key = self.zobrist_key ^ zobrist_castle[rights] ^ zobrist_black_to_move ^ self.enpassant_key()
+        start = move.move_id & 63
+        end = move.move_id >> 6 & 63
+        moved = move.piece_moved
+        captured = move.piece_captured
+        color = moved[0]
+        boards = self.piece_boards
+        colors = self.color_boards
+        squares = self.squares
+        board = self.board
+        score = self.eval_score
+        if captured != '--':
+            taken = start & 56 | end & 7 if move.is_enpassant else end     # en passant takes beside the start
+            bit = 1 << taken
+            boards[captured] ^= bit
+            colors[captured[0]] ^= bit
+            key ^= square_keys[captured][taken]
+            score -= piece_square_values[captured][taken]
+            squares[taken] = '--'
+            board[taken >> 3][taken & 7] = '--'
+            self.halfmove_clock = 0
+        elif moved[1] == 'P':
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        placed = color + move.promotion_piece if move.is_pawn_promotion else moved
+        boards[moved] ^= 1 << start
+        boards[placed] ^= 1 << end
+        colors[color] ^= 1 << start | 1 << end
+        key ^= square_keys[moved][start] ^ square_keys[placed][end]
+        score += piece_square_values[placed][end] - piece_square_values[moved][start]
+        squares[start] = '--'
+        squares[end] = placed
+        board[start >> 3][start & 7] = '--'
+        board[end >> 3][end & 7] = placed
+        if move.is_castle_move:
+            rook = color + 'R'
+            rook_start, rook_end = castle_rook_squares[end]
+            boards[rook] ^= 1 << rook_start | 1 << rook_end
+            colors[color] ^= 1 << rook_start | 1 << rook_end
+            key ^= square_keys[rook][rook_start] ^ square_keys[rook][rook_end]
+            score += piece_square_values[rook][rook_end] - piece_square_values[rook][rook_start]
+            squares[rook_start] = '--'
+            squares[rook_end] = rook
+            board[rook_start >> 3][rook_start & 7] = '--'
+            board[rook_end >> 3][rook_end & 7] = rook
+        self.occupied = colors['w'] | colors['b']
+        self.eval_score = score
+        if moved == 'wK':
+            self.white_king_loc = (end >> 3, end & 7)
+        elif moved == 'bK':
+            self.black_king_loc = (end >> 3, end & 7)
+        self.move_log.append(move)
+        if not self.white_to_move:
+            self.fullmove_number += 1
+        self.white_to_move = not self.white_to_move
+        if moved[1] == 'P' and (end - start == 16 or start - end == 16):
+            self.enpassant_possible = ((start + end) >> 4, start & 7)
+        else:
+            self.enpassant_possible = ()
+        rights_after = rights & castle_keep[start] & castle_keep[end]
+        if rights_after != rights:
+            self.castle_rights.set_bits(rights_after)
+        self.zobrist_key = key ^ zobrist_castle[rights_after] ^ self.enpassant_key()
+        self.repetition_counts[self.zobrist_key] = self.repetition_counts.get(self.zobrist_key, 0) + 1
+
+    def undo_move(self, flag):
+        if self.undo_count == 0:    # nothing to undo at the start of the game or after load_fen
+            return
+        move = self.move_log.pop()
+        if flag:
+            self.move_redo_stack.append(move)
+        self.repetition_counts[self.zobrist_key] -= 1
+        self.undo_count -= 1
+        entry = self.undo_stack[self.undo_count]
+        start = move.move_id & 63
+        end = move.move_id >> 6 & 63
+        moved = move.piece_moved
+        captured = move.piece_captured
+        color = moved[0]
+        boards = self.piece_boards
+        colors = self.color_boards
+        squares = self.squares
+        board = self.board
+        score = self.eval_score
+        placed = color + move.promotion_piece if move.is_pawn_promotion else moved
+        boards[moved] ^= 1 << start
+        boards[placed] ^= 1 << end
+        colors[color] ^= 1 << start | 1 << end
+        score -= piece_square_values[placed][end] - piece_square_values[moved][start]
+        squares[start] = moved
+        squares[end] = '--'
+        board[start >> 3][start & 7] = moved
+        board[end >> 3][end & 7] = '--'
+        if move.is_castle_move:
+            rook = color + 'R'
+            rook_start, rook_end = castle_rook_squares[end]
+            boards[rook] ^= 1 << rook_start | 1 << rook_end
+            colors[color] ^= 1 << rook_start | 1 << rook_end
+            score -= piece_square_values[rook][rook_end] - piece_square_values[rook][rook_start]
+            squares[rook_start] = rook
+            squares[rook_end] = '--'
+            board[rook_start >> 3][rook_start & 7] = rook
+            board[rook_end >> 3][rook_end & 7] = '--'
+        if captured != '--':
+            taken = start & 56 | end & 7 if move.is_enpassant else end
+            boards[captured] ^= 1 << taken
+            colors[captured[0]] ^= 1 << taken
+            score += piece_square_values[captured][taken]
+            squares[taken] = captured
+            board[taken >> 3][taken & 7] = captured
+        self.occupied = colors['w'] | colors['b']
+        self.eval_score = score
+        if moved == 'wK':
+            self.white_king_loc = (start >> 3, start & 7)
+        elif moved == 'bK':
+            self.black_king_loc = (start >> 3, start & 7)
+        self.white_to_move = not self.white_to_move
+        if not self.white_to_move:
+            self.fullmove_number -= 1
+        # Rights, en passant square, clock and key all come back from the entry
+        self.castle_rights.set_bits(entry & 15)
+        self.enpassant_possible = enpassant_squares[self.white_to_move][entry >> 4 & 15]
+        self.zobrist_key = entry >> 28
+        self.halfmove_clock = entry >> 12 & 0xFFFF
+        self.checkmate = False
+        self.stalemate = False
+
+    # Is sq attacked by color's pieces, with the lines blocked by occupied
+    def square_attacked(self, sq, color, occupied):
+        pawn, knight, bishop, rook, queen, king = color_pieces[color]
+        boards = self.piece_boards
+        return bool(pawn_attacks[opponent[color]][sq] & boards[pawn] or knight_attacks[sq] & boards[knight]
+                    or king_attacks[sq] & boards[king]
+                    or rook_attacks(sq, occupied) & (boards[rook] | boards[queen])
+                    or bishop_attacks(sq, occupied) & (boards[bishop] | boards[queen]))
+
+    # Every piece of color attacking sq as a set. Only pieces still in occupied count, so a piece taken off there (an
+    # en passant pawn, an earlier capture of an exchange) neither attacks nor blocks.
+    def attackers(self, sq, color, occupied):
+        pawn, knight, bishop, rook, queen, king = color_pieces[color]
+        boards = self.piece_boards
+        queens = boards[queen]
+        return ((pawn_attacks[opponent[color]][sq] & boards[pawn] | knight_attacks[sq] & boards[knight]
+                 | king_attacks[sq] & boards[king] | rook_attacks(sq, occupied) & (boards[rook] | queens)
+                 | bishop_attacks(sq, occupied) & (boards[bishop] | queens)) & occupied)
+
+    def in_check(self):
+        if self.white_to_move:
+            return self.square_attacked(self.piece_boards['wK'].bit_length() - 1, 'b', self.occupied)
+        return self.square_attacked(self.piece_boards['bK'].bit_length() - 1, 'w', self.occupied)
+
+    # Is the square attacked by the opposite color
+    def king_attacked(self, r, c):
+        return self.square_attacked(r * 8 + c, 'b' if self.white_to_move else 'w', self.occupied)
+
+    # Plays the move if it does not leave our own king attacked, otherwise puts the position back and returns False
+    def make_legal_move(self, move):
+        self.make_move(move)
+        if self.white_to_move:      # black just moved
+            attacked = self.square_attacked(self.piece_boards['bK'].bit_length() - 1, 'w', self.occupied)
+        else:
+            attacked = self.square_attacked(self.piece_boards['wK'].bit_length() - 1, 'b', self.occupied)
+        if attacked:
+            self.undo_move(False)
+            return False
+        return True
+
+    def piece_count(self):
+        return bin(self.occupied).count('1')
+
+    def squares_of(self, piece):
+        squares = []
+        board = self.piece_boards[piece]
+        while board:
+            bit = board & -board
+            board ^= bit
+            squares.append(bit.bit_length() - 1)
+        return squares
+
+    def has_non_pawn_material(self, color):
+        return self.color_boards[color] & ~(self.piece_boards[color + 'P'] | self.piece_boards[color + 'K']) != 0
+
+    # Own pieces pinned to the king as a set, and {square: the squares that piece may still move to}, the line between
+    # king and pinner with the pinner itself
+    def find_pins(self, king_sq, enemy, own):
+        _, _, bishop, rook, queen, _ = color_pieces[enemy]
+        boards = self.piece_boards
+        theirs = self.occupied ^ own
+        # Enemy sliders that would see the king if none of our pieces were in the way
+        snipers = (rook_attacks(king_sq, theirs) & (boards[rook] | boards[queen])
+                   | bishop_attacks(king_sq, theirs) & (boards[bishop] | boards[queen]))
+        pinned = 0
+        pin_lines = {}
+        while snipers:
+            bit = snipers & -snipers
+            snipers ^= bit
+            line = between[king_sq][bit.bit_length() - 1]
+            blockers = line & self.occupied
+            if blockers and not blockers & (blockers - 1):      # exactly one piece between, and it is ours
+                pinned |= blockers
+                pin_lines[blockers.bit_length() - 1] = line | bit
+        return pinned, pin_lines
+
+    # Moves of the side to move except king moves, en passant and castling, without looking at checks unless pinned
+    # and pin_lines (find_pins) are given. Pieces go to captures or quiets, pawns take on captures and push to
+    # pushes, so the promotions can go in a capture-only list or stay out of a quiet one.
+    def add_moves(self, moves, captures, quiets, pushes, pinned=0, pin_lines=None):
+        squares = self.squares
+        board = self.board
+        boards = self.piece_boards
+        occupied = self.occupied
+        empty = occupied ^ full_board
+        color = 'w' if self.white_to_move else 'b'
+        pawn, knight, bishop, rook, queen, _ = color_pieces[color]
+        pawns = boards[pawn]
+        # Pawns all at once by shifting the set, then back from each target to its pawn
+        if color == 'w':
+            one = pawns >> 8 & empty
+            pawn_targets = ((one & pushes, 8), ((one & rank_masks[5]) >> 8 & pushes, 16),
+                            ((pawns & not_file_a) >> 9 & captures, 9), ((pawns & not_file_h) >> 7 & captures, 7))
+        else:
+            one = pawns << 8 & empty
+            pawn_targets = ((one & pushes, -8), ((one & rank_masks[2]) << 8 & pushes, -16),
+                            ((pawns & not_file_a) << 7 & captures, -7), ((pawns & not_file_h) << 9 & captures, -9))
+        last_row = promotion_rows[color]
+        for targets, back in pawn_targets:
+            while targets:
+                bit = targets & -targets
+                targets ^= bit
+                end = bit.bit_length() - 1
+                start = end + back
+                if pinned >> start & 1 and not pin_lines[start] & bit:
+                    continue
+                if bit & last_row:
+                    for flags in promotion_flags:
+                        moves.append(square_move(start, end, squares, board, flags))
+                else:
+                    moves.append(square_move(start, end, squares, board))
+        targets = captures | quiets
+        knights = boards[knight] & ~pinned      # a pinned knight can never stay on the pin line
+        while knights:
+            bit = knights & -knights
+            knights ^= bit
+            start = bit.bit_length() - 1
+            ends = knight_attacks[start] & targets
+            while ends:
+                end_bit = ends & -ends
+                ends ^= end_bit
+                moves.append(square_move(start, end_bit.bit_length() - 1, squares, board))
+        # Queens come up in both loops, their straight and diagonal moves never overlap
+        for sliders, attacks in ((boards[bishop] | boards[queen], bishop_attacks),
+                                 (boards[rook] | boards[queen], rook_attacks)):
+            while sliders:
+                bit = sliders & -sliders
+                sliders ^= bit
+                start = bit.bit_length() - 1
+                ends = attacks(start, occupied) & targets
+                if pinned & bit:
+                    ends &= pin_lines[start]
+                while ends:
+                    end_bit = ends & -ends
+                    ends ^= end_bit
+                    moves.append(square_move(start, end_bit.bit_length() - 1, squares, board))
+
+    # King steps onto targets that the other side does not attack. The king is taken off the board for the test, so
+    # stepping back along the line of a slider that checks it is still check.
+    def add_king_moves(self, moves, targets):
+        color, enemy = ('w', 'b') if self.white_to_move else ('b', 'w')
+        king = self.piece_boards[color + 'K']
+        start = king.bit_length() - 1
+        occupied = self.occupied ^ king
+        ends = king_attacks[start] & targets
+        while ends:
+            end_bit = ends & -ends
+            ends ^= end_bit
+            end = end_bit.bit_length() - 1
+            if not self.square_attacked(end, enemy, occupied):
+                moves.append(square_move(start, end, self.squares, self.board))
+
+    # En passant takes two pawns off the same rank at once, so every capture is tested on the sets it leaves behind
+    def add_enpassant_moves(self, moves):
+        if not self.enpassant_possible:
+            return
+        color, enemy = ('w', 'b') if self.white_to_move else ('b', 'w')
+        end = self.enpassant_possible[0] * 8 + self.enpassant_possible[1]
+        taken = end + 8 if color == 'w' else end - 8
+        king_sq = self.piece_boards[color + 'K'].bit_length() - 1
+        pawns = pawn_attacks[enemy][end] & self.piece_boards[color + 'P']
+        while pawns:
+            bit = pawns & -pawns
+            pawns ^= bit
+            occupied = self.occupied ^ bit ^ (1 << end) ^ (1 << taken)
+            if not self.attackers(king_sq, enemy, occupied):
+                moves.append(square_move(bit.bit_length() - 1, end, self.squares, self.board, move_enpassant_flag))
+
+    # Castling, fully tested: rights, rook in its corner, empty squares between, and the king not in check and not
+    # passing or landing on an attacked square
+    def add_castle_moves(self, moves):
+        color, enemy = ('w', 'b') if self.white_to_move else ('b', 'w')
+        home = 60 if color == 'w' else 4
+        if not self.piece_boards[color + 'K'] >> home & 1:
+            return
+        if color == 'w':
+            king_side, queen_side = self.castle_rights.wks, self.castle_rights.wqs
+        else:
+            king_side, queen_side = self.castle_rights.bks, self.castle_rights.bqs
+        occupied = self.occupied
+        if not (king_side or queen_side) or self.square_attacked(home, enemy, occupied):
+            return
+        rooks = self.piece_boards[color + 'R']
+        if king_side and rooks >> (home + 3) & 1 and not occupied & (3 << (home + 1)):
+            if not self.square_attacked(home + 1, enemy, occupied) and \
+                    not self.square_attacked(home + 2, enemy, occupied):
+                moves.append(square_move(home, home + 2, self.squares, self.board, move_castle_flag))
+        if queen_side and rooks >> (home - 4) & 1 and not occupied & (7 << (home - 3)):
+            if not self.square_attacked(home - 1, enemy, occupied) and \
+                    not self.square_attacked(home - 2, enemy, occupied):
+                moves.append(square_move(home, home - 2, self.squares, self.board, move_castle_flag))
+
+    # Checks and pins are found once from the king, so every generated move is already legal
+    def get_legal_moves(self):
+        color, enemy = ('w', 'b') if self.white_to_move else ('b', 'w')
+        own = self.color_boards[color]
+        theirs = self.color_boards[enemy]
+        empty = self.occupied ^ full_board
+        king_sq = self.piece_boards[color + 'K'].bit_length() - 1
+        checkers = self.attackers(king_sq, enemy, self.occupied)
+        moves = []
+        self.add_king_moves(moves, theirs | empty)
+        if checkers & (checkers - 1):       # double check, only the king can move
+            return moves
+        if checkers:
+            # Single check. Capture the checker or block the line, a knight or pawn check has nothing between.
+            targets = checkers | between[king_sq][checkers.bit_length() - 1]
+        else:
+            targets = full_board
+        pinned, pin_lines = self.find_pins(king_sq, enemy, own)
+        self.add_moves(moves, theirs & targets, empty & targets, empty & targets, pinned, pin_lines)
+        self.add_enpassant_moves(moves)
+        if not checkers:
+            self.add_castle_moves(moves)
+        return moves
+
+    # Moves that follow the piece rules but may leave our own king in check, for search. make_legal_move throws out
+    # the bad ones once a move is actually played.
+    def get_pseudo_legal_moves(self):
+        moves = []
+        color = 'w' if self.white_to_move else 'b'
+        empty = self.occupied ^ full_board
+        theirs = self.color_boards[opponent[color]]
+        self.add_moves(moves, theirs, empty, empty)
+        self.add_king_moves(moves, theirs | empty)
+        self.add_enpassant_moves(moves)
+        self.add_castle_moves(moves)
+        return moves
+
+    # Only the captures and promotions of get_pseudo_legal_moves, for quiescence search
+    def get_capture_moves(self):
+        moves = []
+        color = 'w' if self.white_to_move else 'b'
+        theirs = self.color_boards[opponent[color]]
+        self.add_moves(moves, theirs, 0, (self.occupied ^ full_board) & promotion_rows[color])
+        self.add_king_moves(moves, theirs)
+        self.add_enpassant_moves(moves)
+        return moves
+
+    # The rest of get_pseudo_legal_moves: pushes that do not promote, steps and slides to empty squares and castling
+    def get_quiet_moves(self):
+        moves = []
+        color = 'w' if self.white_to_move else 'b'
+        empty = self.occupied ^ full_board
+        self.add_moves(moves, 0, empty, empty & ~promotion_rows[color])
+        self.add_king_moves(moves, empty)
+        self.add_castle_moves(moves)
+        return moves
+
+    # move itself if the piece on its start square can make it here (see GameState.find_move), else None. Tested
+    # against the sets directly, nothing is generated except for castling.
+    def find_move(self, move):
+        start = move.move_id & 63
+        end = move.move_id >> 6 & 63
+        piece = self.squares[start]
+        color = 'w' if self.white_to_move else 'b'
+        if piece != move.piece_moved or piece[0] != color:
+            return None
+        if move.is_castle_move:
+            moves = []
+            self.add_castle_moves(moves)
+            for generated in moves:
+                if generated.move_id == move.move_id:
+                    return generated
+            return None
+        target = self.squares[end]
+        kind = piece[1]
+        if move.is_enpassant:
+            if self.enpassant_possible and end == self.enpassant_possible[0] * 8 + self.enpassant_possible[1] \
+                    and pawn_attacks[color][start] >> end & 1:
+                moves = []
+                self.add_enpassant_moves(moves)
+                for generated in moves:
+                    if generated.move_id == move.move_id:
+                        return generated
+            return None
+        if target != move.piece_captured or target[0] == color:
+            return None
+        if kind == 'P':
+            forward = -8 if color == 'w' else 8
+            if target != '--':
+                reachable = pawn_attacks[color][start] >> end & 1
+            elif end == start + forward:
+                reachable = True
+            else:
+                reachable = (end == start + 2 * forward and start >> 3 == (6 if color == 'w' else 1)
+                             and self.squares[start + forward] == '--')
+        elif kind == 'N':
+            reachable = knight_attacks[start] >> end & 1
+        elif kind == 'K':
+            reachable = king_attacks[start] >> end & 1 and not self.square_attacked(
+                end, opponent[color], self.occupied ^ (1 << start))
+        elif kind == 'B':
+            reachable = bishop_attacks(start, self.occupied) >> end & 1
+        elif kind == 'R':
+            reachable = rook_attacks(start, self.occupied) >> end & 1
+        else:
+            reachable = (rook_attacks(start, self.occupied) | bishop_attacks(start, self.occupied)) >> end & 1
+        return move if reachable else None
+
+    # Static exchange evaluation like GameState's, with attacker sets: taking a piece off occupied opens the lines
+    # behind it, so x-ray attackers join in by themselves.
+    def static_exchange(self, move):
+        end = move.move_id >> 6 & 63
+        occupied = self.occupied ^ (1 << (move.move_id & 63))
+        gains = [piece_score[move.piece_captured[1]] if move.piece_captured != '--' else 0]
+        on_square = piece_score[move.piece_moved[1]]
+        color = 'b' if self.white_to_move else 'w'
+        boards = self.piece_boards
+        while True:
+            attackers = self.attackers(end, color, occupied)
+            if not attackers:
+                break
+            for piece in color_pieces[color]:
+                found = boards[piece] & attackers
+                if found:
+                    break
+            bit = found & -found
+            other = opponent[color]
+            if piece[1] == 'K' and self.attackers(end, other, occupied ^ bit):
+                break       # the king can only take a piece nothing defends
+            gains.append(on_square - gains[-1])
+            on_square = piece_score[piece[1]]
+            occupied ^= bit
+            color = other
+        # Going back from the last capture, each side only takes if that beats stopping
+        for i in range(len(gains) - 1, 0, -1):
+            gains[i - 1] = -max(-gains[i - 1], gains[i])
+        return gains[0]
@@ -1,7 +1,112 @@
 # File responsible for current state of game and determining current valid moves.
+import random
+import struct
+from collections import OrderedDict
+
+from ChessEval import piece_score, piece_square_values
+
+# Zobrist keys. Fixed seed so every process (AI workers, perft pools) hashes positions the same way.
+# '--' maps to zeros so set_square can xor the old and new piece without checking for empty squares.
+_zobrist_random = random.Random(20240607)
+pieces = ('wP', 'wN', 'wB', 'wR', 'wQ', 'wK', 'bP', 'bN', 'bB', 'bR', 'bQ', 'bK')
+zobrist_pieces = {piece: [[_zobrist_random.getrandbits(64) for _ in range(8)] for _ in range(8)] for piece in pieces}
+zobrist_pieces['--'] = [[0] * 8 for _ in range(8)]
+zobrist_castle = [_zobrist_random.getrandbits(64) for _ in range(16)]      # indexed by Castle.bits()
+zobrist_enpassant = [_zobrist_random.getrandbits(64) for _ in range(8)]    # indexed by en passant column
+zobrist_black_to_move = _zobrist_random.getrandbits(64)
+
+start_fen = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+fen_pieces = {'P': 'wP', 'N': 'wN', 'B': 'wB', 'R': 'wR', 'Q': 'wQ', 'K': 'wK',
+              'p': 'bP', 'n': 'bN', 'b': 'bB', 'r': 'bR', 'q': 'bQ', 'k': 'bK'}
+piece_to_fen = {v: k for k, v in fen_pieces.items()}
+# Bulk loading sees the same few ranks ("8", "pppppppp", ...) over and over, so parsed ranks are cached both ways.
+fen_rank_cache = {}
+fen_row_cache = {}
+fen_cache_limit = 100000
+
+
+# One FEN rank to a board row, or None if it is not 8 valid squares. Returns a fresh list the caller may keep.
+def parse_fen_rank(rank):
+    row = fen_rank_cache.get(rank)
+    if row is None:
+        row = []
+        for char in rank:
+            if char in fen_pieces:
+                row.append(fen_pieces[char])
+            elif '1' <= char <= '8':
+                row.extend(['--'] * int(char))
+            else:
+                return None
+        if len(row) != 8:
+            return None
+        if len(fen_rank_cache) >= fen_cache_limit:
+            fen_rank_cache.clear()
+        fen_rank_cache[rank] = row
+    return row[:]
+
+
+# Move tables, built once at import so the generators never do offset arithmetic or bounds checks.
+# Directions: rook directions first, then bishop directions. The *_squares tables number squares row * 8 + col
+# like ChessBitboard and feed the attack maps, the *_targets tables hold the same squares as (row, col) for the board.
+directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+opposite_direction = (2, 3, 0, 1, 7, 6, 5, 4)     # index of the direction pointing the other way
+slider_directions = {'R': range(4), 'B': range(4, 8), 'Q': range(8)}
+# Pieces that keep attacking along each direction
+line_pieces = [{'wR', 'wQ', 'bR', 'bQ'}] * 4 + [{'wB', 'wQ', 'bB', 'bQ'}] * 4
+
+
+def _square_table(offsets):
+    table = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        table.append(tuple((r + dr) * 8 + c + dc for dr, dc in offsets if 0 <= r + dr <= 7 and 0 <= c + dc <= 7))
+    return table
+
+
+def _ray(sq, dr, dc):
+    squares = []
+    r, c = divmod(sq, 8)
+    r, c = r + dr, c + dc
+    while 0 <= r <= 7 and 0 <= c <= 7:
+        squares.append(r * 8 + c)
+        r, c = r + dr, c + dc
+    return tuple(squares)
+
+
+knight_squares = _square_table(((-2, -1), (-2, 1), (2, -1), (2, 1), (-1, 2), (-1, -2), (1, 2), (1, -2)))
+king_squares = _square_table(directions)
+pawn_attack_squares = {'w': _square_table(((-1, -1), (-1, 1))), 'b': _square_table(((1, -1), (1, 1)))}
+ray_squares = [tuple(_ray(sq, dr, dc) for dr, dc in directions) for sq in range(64)]    # [square][direction]
+
+
+def _target_table(table):
+    return [[tuple(divmod(s, 8) for s in table[r * 8 + c]) for c in range(8)] for r in range(8)]
+
+
+knight_targets = _target_table(knight_squares)      # [row][col] -> ((row, col), ...)
+king_targets = _target_table(king_squares)
+pawn_attack_targets = {'w': _target_table(pawn_attack_squares['w']), 'b': _target_table(pawn_attack_squares['b'])}
+ray_targets = [[tuple(tuple(divmod(s, 8) for s in ray) for ray in ray_squares[r * 8 + c]) for c in range(8)]
+               for r in range(8)]                   # [row][col][direction] -> squares going out from (row, col)
+
+
+# Undo stack entry, one int per move: bits 0-3 castle rights (Castle.bits()), 4-7 en passant column + 1 (0 if none),
+# 8-11 captured piece code, 12-27 halfmove clock, 28 and up the zobrist key. All from before the move.
+# The stack is a preallocated list that doubles when a game runs past its length.
+undo_stack_size = 256
+# En passant square from the packed column, [side to move][column + 1]. The square is behind the pawn that just moved.
+enpassant_squares = (((),) + tuple((5, c) for c in range(8)), ((),) + tuple((2, c) for c in range(8)))
+
+
+# Position snapshot: 64 piece codes (piece_codes, square row * 8 + col), flags (bit 0 white to move, bits 1-4 castle
+# rights), en passant column + 1, halfmove clock, fullmove number, number of keys, then that many 64 bit zobrist keys
+# of the positions before the last moves, oldest first.
+snapshot_header = struct.Struct('<64sBBHHB')
+snapshot_history_limit = 100        # the 50 move rule ends the game before any older position could repeat
+
 
 class GameState():
-    def __init__(self):
+    def __init__(self, fen=None):
         self.board = [
             ["bR", "bN", "bB", "bQ", "bK", "bB", "bN", "bR"],
             ["bP", "bP", "bP", "bP", "bP", "bP", "bP", "bP"],
@@ -12,9 +117,7 @@ class GameState():
             ["wP", "wP", "wP", "wP", "wP", "wP", "wP", "wP"],
             ["wR", "wN", "wB", "wQ", "wK", "wB", "wN", "wR"]
         ]
-        self.move_list = {'P': self.get_pawn_moves, 'R': self.get_rook_moves, 'N': self.get_knight_moves,
-                          'B': self.get_bishop_moves, 'Q': self.get_queen_moves, 'K': self.get_king_moves}
-        # This is just to make code look more clean.
+        self.init_buffers()
 
         # 8x8 2d list. Labeled "colorPiece"
         self.white_to_move = True
@@ -26,18 +129,297 @@ class GameState():
         self.stalemate = False
         self.stalemate_by_repeat = False
         self.enpassant_possible = ()        # temporary holder for when en passant is possible.
-        self.enpassant_possible_log = [self.enpassant_possible]
-        self.redo_enpassant_possible = ()
         self.castle_rights = Castle(True, True, True, True)
-        self.castle_rights_log = [Castle(self.castle_rights.wks, self.castle_rights.bks,
-                                         self.castle_rights.wqs, self.castle_rights.bqs)]
-        self.redo_castle_rights = [Castle(self.castle_rights.wks, self.castle_rights.bks,
-                                          self.castle_rights.wqs, self.castle_rights.bqs)]
+        self.stalemate_by_fifty_moves = False
+        self.halfmove_clock = 0             # plies since the last capture or pawn move
+        self.fullmove_number = 1            # goes up after every black move, like in FEN
+        self.undo_count = 0
+        self.zobrist_key = self.compute_zobrist_key()
+        self.compute_piece_squares()
+        self.compute_attack_counts()            # attack_counts[color][square]: how many of color's pieces hit it
+        # Maps for each ply of the undo stack, made once and written in place, undo_move goes back to the one below
+        self.attack_counts_stack = [self.attack_counts]
+        self.repetition_counts = {self.zobrist_key: 1}
+        if fen is not None:
+            self.load_fen(fen)
+
+    # The parts of a GameState that do not depend on the position. from_snapshot only runs this, not __init__.
+    def init_buffers(self):
+        self.move_list = {'P': self.get_pawn_moves, 'R': self.get_rook_moves, 'N': self.get_knight_moves,
+                          'B': self.get_bishop_moves, 'Q': self.get_queen_moves, 'K': self.get_king_moves}
+        # This is just to make code look more clean.
+        self.pins = {}          # pinned square: direction of the pin. Filled by get_legal_moves
+        self.checks = []
+        self.undo_stack = [0] * undo_stack_size     # one packed int per move in move_log, see undo_entry
+
+    # Set up any position from a FEN string. Clears the move history, the position becomes the new start.
+    def load_fen(self, fen):
+        fields = fen.split()
+        if len(fields) < 4:
+            raise ValueError("FEN needs at least 4 fields: " + fen)
+        ranks = fields[0].split('/')
+        if len(ranks) != 8:
+            raise ValueError("FEN needs 8 ranks: " + fen)
+        board = []
+        self.white_king_loc = self.black_king_loc = ()
+        for r in range(8):
+            row = parse_fen_rank(ranks[r])
+            if row is None:
+                raise ValueError("Bad rank " + ranks[r] + " in FEN: " + fen)
+            if 'K' in ranks[r]:
+                self.white_king_loc = (r, row.index('wK'))
+            if 'k' in ranks[r]:
+                self.black_king_loc = (r, row.index('bK'))
+            board.append(row)
+        if self.white_king_loc == () or self.black_king_loc == ():
+            raise ValueError("FEN needs both kings: " + fen)
+        self.board = board
+
+        self.white_to_move = fields[1] == 'w'
+        self.castle_rights = Castle('K' in fields[2], 'k' in fields[2], 'Q' in fields[2], 'q' in fields[2])
+        if fields[3] == '-':
+            self.enpassant_possible = ()
+        elif len(fields[3]) == 2 and fields[3][0] in Move.files_to_cols and fields[3][1] in ('3', '6'):
+            self.enpassant_possible = (Move.ranks_to_row[fields[3][1]], Move.files_to_cols[fields[3][0]])
+        else:
+            raise ValueError("Bad en passant square " + fields[3] + " in FEN: " + fen)
+        self.halfmove_clock = int(fields[4]) if len(fields) > 4 else 0
+        self.fullmove_number = int(fields[5]) if len(fields) > 5 else 1
+        self.position_loaded()
+
+    # The board and state were replaced wholesale (load_fen, load_snapshot). Clears the history and rebuilds the key,
+    # piece sets and attack maps. Backends with their own sets (ChessBitboard) rebuild them here too.
+    def position_loaded(self):
+        self.move_log = []
+        self.move_redo_stack = []
+        self.checkmate = False
+        self.stalemate = False
+        self.stalemate_by_repeat = False
+        self.stalemate_by_fifty_moves = False
+        self.undo_count = 0
+        self.zobrist_key = self.compute_zobrist_key()
+        self.repetition_counts = {self.zobrist_key: 1}
+        self.compute_piece_squares()
+        self.compute_attack_counts()
+        self.attack_counts_stack = [self.attack_counts]
+
+    # Small fixed layout for handing a position to another process (the AI): see snapshot_header. The key history only
+    # covers moves since the last capture or pawn move, the only positions that can still repeat, so the size does not
+    # grow with the game.
+    def get_snapshot(self):
+        flags = self.white_to_move | self.castle_rights.bits() << 1
+        enpassant = self.enpassant_possible[1] + 1 if self.enpassant_possible else 0
+        count = min(self.halfmove_clock, self.undo_count, snapshot_history_limit)
+        keys = [self.undo_stack[i] >> 28 for i in range(self.undo_count - count, self.undo_count)]
+        return (snapshot_header.pack(bytes(map(piece_codes.__getitem__, self.squares)), flags, enpassant,
+                                     min(self.halfmove_clock, 0xFFFF), min(self.fullmove_number, 0xFFFF), count)
+                + struct.pack('<%dQ' % count, *keys))
+
+    # Counterpart of get_snapshot. Like load_fen the position becomes the new start, nothing can be undone.
+    def load_snapshot(self, data):
+        if len(data) < snapshot_header.size:
+            raise ValueError("Snapshot too short")
+        codes, flags, enpassant, halfmove, fullmove, count = snapshot_header.unpack_from(data)
+        if len(data) != snapshot_header.size + 8 * count or max(codes) >= len(piece_names) or enpassant > 8:
+            raise ValueError("Bad snapshot")
+        if codes.count(piece_codes['wK']) != 1 or codes.count(piece_codes['bK']) != 1:
+            raise ValueError("Snapshot needs one king of each color")
+        self.board = [[piece_names[code] for code in codes[r * 8:r * 8 + 8]] for r in range(8)]
+        self.white_king_loc = divmod(codes.index(piece_codes['wK']), 8)
+        self.black_king_loc = divmod(codes.index(piece_codes['bK']), 8)
+        self.white_to_move = flags & 1 == 1
+        self.castle_rights = Castle(False, False, False, False)
+        self.castle_rights.set_bits(flags >> 1)
+        self.enpassant_possible = enpassant_squares[self.white_to_move][enpassant]
+        self.halfmove_clock = halfmove
+        self.fullmove_number = fullmove
+        self.position_loaded()
+        for key in struct.unpack_from('<%dQ' % count, data, snapshot_header.size):
+            self.repetition_counts[key] = self.repetition_counts.get(key, 0) + 1
+
+    @classmethod
+    def from_snapshot(cls, data):
+        # load_snapshot sets up the whole position, building the start position first would only be thrown away
+        gamestate = cls.__new__(cls)
+        gamestate.init_buffers()
+        gamestate.load_snapshot(data)
+        return gamestate
+
+    def get_fen(self):
+        ranks = []
+        for row in self.board:
+            key = ''.join(row)
+            rank = fen_row_cache.get(key)
+            if rank is None:
+                rank = ''
+                empty = 0
+                for square in row:
+                    if square == '--':
+                        empty += 1
+                    else:
+                        if empty:
+                            rank += str(empty)
+                            empty = 0
+                        rank += piece_to_fen[square]
+                if empty:
+                    rank += str(empty)
+                if len(fen_row_cache) >= fen_cache_limit:
+                    fen_row_cache.clear()
+                fen_row_cache[key] = rank
+            ranks.append(rank)
+        castle = ''
+        if self.castle_rights.wks:
+            castle += 'K'
+        if self.castle_rights.wqs:
+            castle += 'Q'
+        if self.castle_rights.bks:
+            castle += 'k'
+        if self.castle_rights.bqs:
+            castle += 'q'
+        if self.enpassant_possible:
+            enpassant = Move.cols_to_files[self.enpassant_possible[1]] + Move.rows_to_rank[self.enpassant_possible[0]]
+        else:
+            enpassant = '-'
+        return (('/'.join(ranks)) + (' w ' if self.white_to_move else ' b ') + (castle or '-') + ' ' + enpassant
+                + ' ' + str(self.halfmove_clock) + ' ' + str(self.fullmove_number))
+
+    # Full key from scratch. make_move / undo_move keep self.zobrist_key up to date without calling this.
+    def compute_zobrist_key(self):
+        key = 0
+        for r in range(8):
+            for c in range(8):
+                key ^= zobrist_pieces[self.board[r][c]][r][c]
+        key ^= zobrist_castle[self.castle_rights.bits()] ^ self.enpassant_key()
+        if not self.white_to_move:
+            key ^= zobrist_black_to_move
+        return key
+
+    # The en passant file is only part of the key when a pawn of the side to move stands next to the pawn that just
+    # moved two squares, otherwise the same position after a quiet double push would never repeat (Polyglot does
+    # the same). Legality of the capture is not looked at.
+    def enpassant_key(self):
+        if not self.enpassant_possible:
+            return 0
+        ep_row, ep_col = self.enpassant_possible
+        pawn_row = self.board[ep_row + 1 if self.white_to_move else ep_row - 1]
+        pawn = 'wP' if self.white_to_move else 'bP'
+        if (ep_col > 0 and pawn_row[ep_col - 1] == pawn) or (ep_col < 7 and pawn_row[ep_col + 1] == pawn):
+            return zobrist_enpassant[ep_col]
+        return 0
+
+    # squares is the board as one flat list (index row * 8 + col), piece_squares the set of squares each piece is on,
+    # eval_score the material and table score in centipawns from white's view (ChessEval). Built once here,
+    # set_square keeps all three up to date.
+    def compute_piece_squares(self):
+        self.squares = [piece for row in self.board for piece in row]
+        self.piece_squares = {piece: set() for piece in pieces}
+        self.eval_score = 0
+        for sq in range(64):
+            if self.squares[sq] != '--':
+                self.piece_squares[self.squares[sq]].add(sq)
+                self.eval_score += piece_square_values[self.squares[sq]][sq]
+
+    # Full attack maps from scratch. set_square keeps them up to date after this.
+    def compute_attack_counts(self):
+        self.attack_counts = {'w': [0] * 64, 'b': [0] * 64}
+        for piece, squares in self.piece_squares.items():
+            for sq in squares:
+                self.add_attacks(sq, piece, 1)
+
+    # Add (amount 1) or take away (amount -1) the squares a piece on sq attacks. Own pieces count as attacked too,
+    # so a king can not take a defended piece.
+    def add_attacks(self, sq, piece, amount):
+        counts = self.attack_counts[piece[0]]
+        kind = piece[1]
+        if kind == 'P':
+            squares = pawn_attack_squares[piece[0]][sq]
+        elif kind == 'N':
+            squares = knight_squares[sq]
+        elif kind == 'K':
+            squares = king_squares[sq]
+        else:
+            squares = self.squares
+            rays = ray_squares[sq]
+            for d in slider_directions[kind]:
+                for s in rays[d]:
+                    counts[s] += amount
+                    if squares[s] != '--':    # the first piece on the line is hit, nothing behind it
+                        break
+            return
+        for s in squares:
+            counts[s] += amount
+
+    # sq just became empty (amount 1) or occupied (amount -1). Every slider looking at sq now sees further or less far.
+    def update_attacks_through(self, sq, amount):
+        squares = self.squares
+        rays = ray_squares[sq]
+        for d in range(8):
+            for s in rays[d]:
+                piece = squares[s]
+                if piece != '--':
+                    if piece in line_pieces[d]:
+                        counts = self.attack_counts[piece[0]]
+                        for t in rays[opposite_direction[d]]:
+                            counts[t] += amount
+                            if squares[t] != '--':
+                                break
+                    break
+
+    # Every board write goes through here so other backends (ChessBitboard) can keep their own sets in sync.
+    # Keeps the zobrist key and the attack maps in step with the board. undo_move goes back to the maps of the ply
+    # below in attack_counts_stack instead and sets them to None while it writes.
+    def set_square(self, r, c, piece):
+        old = self.board[r][c]
+        self.zobrist_key ^= zobrist_pieces[old][r][c] ^ zobrist_pieces[piece][r][c]
+        sq = r * 8 + c
+        self.board[r][c] = piece
+        self.squares[sq] = piece
+        self.eval_score += piece_square_values[piece][sq] - piece_square_values[old][sq]
+        if old != '--':
+            self.piece_squares[old].discard(sq)
+        if piece != '--':
+            self.piece_squares[piece].add(sq)
+        if self.attack_counts is None:
+            return
+        if old != '--':
+            self.add_attacks(sq, old, -1)
+        if old == '--':
+            if piece != '--':
+                self.update_attacks_through(sq, -1)
+        elif piece == '--':
+            self.update_attacks_through(sq, 1)
+        if piece != '--':
+            self.add_attacks(sq, piece, 1)
+
+    # Everything undo_move can not get back from the Move itself, packed into one int. See undo_stack_size.
+    def undo_entry(self, move):
+        return (self.castle_rights.bits() | (self.enpassant_possible[1] + 1 if self.enpassant_possible else 0) << 4
+                | piece_codes[move.piece_captured] << 8 | min(self.halfmove_clock, 0xFFFF) << 12
+                | self.zobrist_key << 28)
 
     def make_move(self, move):  # Assuming move is valid and NOT special moves like castling, promotion & en-passant
-        self.board[move.start_row][move.start_col] = "--"
-        self.board[move.end_row][move.end_col] = move.piece_moved
+        if self.undo_count == len(self.undo_stack):
+            self.undo_stack.extend([0] * len(self.undo_stack))
+        self.undo_stack[self.undo_count] = self.undo_entry(move)
+        self.undo_count += 1
+        # take the old en passant and castle rights out of the key, the new ones go back in at the end
+        self.zobrist_key ^= zobrist_castle[self.castle_rights.bits()] ^ zobrist_black_to_move ^ self.enpassant_key()
+        stack = self.attack_counts_stack
+        if self.undo_count == len(stack):
+            stack.append({'w': [0] * 64, 'b': [0] * 64})
+        attack_counts = stack[self.undo_count]
+        attack_counts['w'][:] = self.attack_counts['w']     # copied into the existing lists, nothing is allocated
+        attack_counts['b'][:] = self.attack_counts['b']
+        self.attack_counts = attack_counts
+        if move.piece_moved[1] == 'P' or move.piece_captured != '--':
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        self.set_square(move.start_row, move.start_col, "--")
+        self.set_square(move.end_row, move.end_col, move.piece_moved)
         self.move_log.append(move)  # log move so we can undo it later
+        if not self.white_to_move:
+            self.fullmove_number += 1
         self.white_to_move = not self.white_to_move  # swap players. Not negates current boolean (flips)
         # Tracking King location
         if move.piece_moved == 'wK':
@@ -45,13 +427,13 @@ class GameState():
         elif move.piece_moved == 'bK':
             self.black_king_loc = (move.end_row, move.end_col)
 
-        # pawn promotion. Only Queen for now because my 'fake' moves will mess with this.
+        # pawn promotion
         if move.is_pawn_promotion:
-            self.board[move.end_row][move.end_col] = move.piece_moved[0] + 'Q'
+            self.set_square(move.end_row, move.end_col, move.piece_moved[0] + move.promotion_piece)
 
         # Because enpassant will remove the pawn not on same square
         if move.is_enpassant:
-            self.board[move.start_row][move.end_col] = '--'
+            self.set_square(move.start_row, move.end_col, '--')
         # update en passant_possible when pawn moves twice
         if move.piece_moved[1] == 'P' and abs(move.start_row - move.end_row) == 2:
             self.enpassant_possible = ((move.start_row + move.end_row)//2, move.start_col)
@@ -61,116 +443,92 @@ class GameState():
 
         if move.is_castle_move:
             if move.end_col - move.start_col == 2:      # King side. Only need to move rook. I copied it over
-                self.board[move.end_row][move.end_col - 1] = self.board[move.end_row][move.end_col + 1]
-                self.board[move.end_row][move.end_col + 1] = '--'       # remove old rook
+                self.set_square(move.end_row, move.end_col - 1, self.board[move.end_row][move.end_col + 1])
+                self.set_square(move.end_row, move.end_col + 1, '--')       # remove old rook
             else:                                       # Queen side.
-                self.board[move.end_row][move.end_col + 1] = self.board[move.end_row][move.end_col - 2]
-                self.board[move.end_row][move.end_col - 2] = '--'       # remove old rook
-
-        self.enpassant_possible_log.append(self.enpassant_possible)
+                self.set_square(move.end_row, move.end_col + 1, self.board[move.end_row][move.end_col - 2])
+                self.set_square(move.end_row, move.end_col - 2, '--')       # remove old rook
 
         self.update_castle_rights(move)
-        self.castle_rights_log.append(Castle(self.castle_rights.wks, self.castle_rights.bks,
-                                             self.castle_rights.wqs, self.castle_rights.bqs))
+
+        self.zobrist_key ^= zobrist_castle[self.castle_rights.bits()] ^ self.enpassant_key()
+        self.repetition_counts[self.zobrist_key] = self.repetition_counts.get(self.zobrist_key, 0) + 1
+
+    # Passes the turn without moving, for null move pruning in search. Only the side to move, en passant and the key
+    # change, the board and attack maps stay as they are. Returns what undo_null_move needs to put it back. Not in
+    # move_log, so undo it with undo_null_move before any undo_move.
+    def make_null_move(self):
+        enpassant = self.enpassant_possible
+        self.zobrist_key ^= self.enpassant_key() ^ zobrist_black_to_move
+        self.enpassant_possible = ()
+        self.white_to_move = not self.white_to_move
+        self.repetition_counts[self.zobrist_key] = self.repetition_counts.get(self.zobrist_key, 0) + 1
+        return enpassant
+
+    def undo_null_move(self, enpassant):
+        self.repetition_counts[self.zobrist_key] -= 1
+        self.white_to_move = not self.white_to_move
+        self.zobrist_key ^= zobrist_black_to_move
+        self.enpassant_possible = enpassant
+        self.zobrist_key ^= self.enpassant_key()
 
     def undo_move(self, flag):
-        if len(self.move_log) != 0:  # if a move can not be undone
+        if self.undo_count != 0:  # nothing to undo at the start of the game or after load_fen
             move = self.move_log.pop()
             if flag:
                 self.move_redo_stack.append(move)
-                # Save old rights for Redo only if actual redo has been done
-                self.redo_enpassant_possible = self.enpassant_possible
-                self.redo_castle_rights = self.castle_rights
+            self.repetition_counts[self.zobrist_key] -= 1
+            self.undo_count -= 1
+            entry = self.undo_stack[self.undo_count]
+            captured = piece_names[entry >> 8 & 15]
+            self.attack_counts = None
 
-            self.board[move.start_row][move.start_col] = move.piece_moved
-            self.board[move.end_row][move.end_col] = move.piece_captured
+            self.set_square(move.start_row, move.start_col, move.piece_moved)
+            self.set_square(move.end_row, move.end_col, captured)
             self.white_to_move = not self.white_to_move
+            if not self.white_to_move:
+                self.fullmove_number -= 1
             if move.piece_moved == 'wK':
                 self.white_king_loc = (move.start_row, move.start_col)
             elif move.piece_moved == 'bK':
                 self.black_king_loc = (move.start_row, move.start_col)
 
             if move.is_enpassant:           # undo en passant
-                self.board[move.end_row][move.end_col] = '--'       # Leave captured square blank
-                self.board[move.start_row][move.end_col] = move.piece_captured
-
-            self.enpassant_possible_log.pop()
-            self.enpassant_possible = self.enpassant_possible_log[-1]
+                self.set_square(move.end_row, move.end_col, '--')       # Leave captured square blank
+                self.set_square(move.start_row, move.end_col, captured)
 
-            # undo castle rights. Remove the new one and set to last one in list. r
-            # Bug: Too many undoes can make log become empty and cause new_rights to attempt to copy from empty
-            self.castle_rights_log.pop()
-            new_rights = self.castle_rights_log[-1]
-            self.castle_rights = Castle(new_rights.wks, new_rights.bks, new_rights.wqs, new_rights.bqs)
-            # castle_rights = self.castle_rights[-1] causes more bugs compared to this method so yeah.
+            # Rights, en passant square and clock all come back from the entry, nothing new is made
+            self.castle_rights.set_bits(entry & 15)
+            self.enpassant_possible = enpassant_squares[self.white_to_move][entry >> 4 & 15]
 
             if move.is_castle_move:
                 if move.end_col - move.start_col == 2:  # King side. Need to reset rook. Copying where it was
-                    self.board[move.end_row][move.end_col + 1] = self.board[move.end_row][move.end_col - 1]
-                    self.board[move.end_row][move.end_col - 1] = '--'  # remove old rook
+                    self.set_square(move.end_row, move.end_col + 1, self.board[move.end_row][move.end_col - 1])
+                    self.set_square(move.end_row, move.end_col - 1, '--')  # remove old rook
                 else:  # Queen side.
-                    self.board[move.end_row][move.end_col - 2] = self.board[move.end_row][move.end_col + 1]
-                    self.board[move.end_row][move.end_col + 1] = '--'  # remove old rook
+                    self.set_square(move.end_row, move.end_col - 2, self.board[move.end_row][move.end_col + 1])
+                    self.set_square(move.end_row, move.end_col + 1, '--')  # remove old rook
+
+            # Pieces were xor'd back by set_square, side / rights / en passant come back with the previous key
+            self.zobrist_key = entry >> 28
+            self.halfmove_clock = entry >> 12 & 0xFFFF
+            self.attack_counts = self.attack_counts_stack[self.undo_count]
 
             self.checkmate = False
             self.stalemate = False
 
+    # Replaying through make_move keeps the undo stack, rights and key identical to when the move was first made.
     def redo_move(self):
         if len(self.move_redo_stack) != 0:
-            move = self.move_redo_stack.pop()
-            self.move_log.append(move)  # re-append to move log.
-            self.board[move.end_row][move.end_col] = move.piece_moved
-            self.board[move.start_row][move.start_col] = move.piece_captured
-            self.white_to_move = not self.white_to_move
-            if move.piece_moved == 'wK':
-                self.white_king_loc = (move.end_row, move.end_col)
-            elif move.piece_moved == 'bK':
-                self.black_king_loc = (move.end_row, move.end_col)
-
-            if move.is_enpassant:
-                self.board[move.end_row][move.end_col] = move.piece_moved      # Leave captured square blank
-                self.board[move.start_row][move.end_col] = '--'
-                # Undo incorrect movement
-                self.board[move.start_row][move.start_col] = '--'
-                self.enpassant_possible = (move.end_row, move.end_col)
-            # if it was enpassant redo the save
-            # This one is more specific
-            if move.piece_moved[1] == 'P' and abs(move.start_row - move.end_row) == 2 and move.start_row == 6:
-                self.enpassant_possible = (move.start_row - 1, move.end_col)
-            elif move.piece_moved[1] == 'P' and abs(move.start_row - move.end_row) == 2 and move.start_row == 1:
-                self.enpassant_possible = (move.start_row + 1, move.end_col)
-
-            # Redo rights. Used previous remembered rights
-            self.redo_enpassant_possible = self.enpassant_possible
-            self.castle_rights = self.redo_castle_rights
+            self.make_move(self.move_redo_stack.pop())
 
-            if move.is_castle_move:
-                if move.end_col - move.start_col == 2:  # King side. Only need to move rook. I copied it over
-                    self.board[move.end_row][move.end_col - 1] = self.board[move.end_row][move.end_col + 1]
-                    self.board[move.end_row][move.end_col + 1] = '--'  # remove old rook
-                else:  # Queen side.
-                    self.board[move.end_row][move.end_col + 1] = self.board[move.end_row][move.end_col - 2]
-                    self.board[move.end_row][move.end_col - 2] = '--'  # remove old rook
-
-    def get_valid_moves(self):  # for things like pins and checks
-        temp_enpassant_possible = self.enpassant_possible
-        temp_castle_rights = Castle(self.castle_rights.wks, self.castle_rights.bks,
-                                    self.castle_rights.wqs, self.castle_rights.bqs)
-        # 1) get all possible moves
-        moves = self.get_possible_moves()
-        if self.white_to_move and self.white_king_loc == (7, 4):  # Castling moves
-            self.get_castle_moves(self.white_king_loc[0], self.white_king_loc[1], moves)
-        elif self.black_king_loc == (0, 4):     # added this due to some weird failsafe with undoing
-            self.get_castle_moves(self.black_king_loc[0], self.black_king_loc[1], moves)
-        # 2) for each move, make the move
-        for i in range(len(moves)-1, -1, -1):
-            self.make_move(moves[i])
-            self.white_to_move = not self.white_to_move
-            # Checking if King is checked after making move by acting as all attack moves
-            if self.in_check():
-                moves.remove(moves[i])
-            self.white_to_move = not self.white_to_move
-            self.undo_move(False)                           # undo the test move
+    # Legal moves of this position with square indexes, from legal_move_cache so known positions (undo, redo, the
+    # same position in a search) are not generated again.
+    def get_move_set(self):
+        return legal_move_cache.get(self)
+
+    def get_valid_moves(self):  # for things like pins and checks. The list is shared with the cache, do not change it
+        moves = self.get_move_set().moves
         if len(moves) == 0:             # Either checkmate or stalemate if no possible moves
             if self.in_check():
                 self.checkmate = True
@@ -180,37 +538,282 @@ class GameState():
             self.checkmate = False
             self.stalemate = False
             self.stalemate_by_repeat = False
-        # stalemate if last 3 are the same from both sides.
-        # This is so inefficient, but I can't loop because my brain is off.
-        # Because have to make sure only certain moves are same and no differences in between
-        if len(self.move_log) >= 8:
-            last_move = self.move_log[-1]
-            second_move = self.move_log[-2]
-            third_move = self.move_log[-3]
-            fourth_move = self.move_log[-4]
-            fifth_move = self.move_log[-5]
-            sixth_move = self.move_log[-6]
-            seventh_move = self.move_log[-7]
-            eighth_move = self.move_log[-8]
-            if ((eighth_move == fourth_move) and (seventh_move == third_move) and (sixth_move == second_move)
-                    and (fifth_move == last_move)):
+            self.stalemate_by_fifty_moves = False
+            # Draws only count if the side to move is not already mated
+            if self.is_repetition():
                 self.stalemate = True
                 self.stalemate_by_repeat = True
-            else:
-                self.stalemate = False
-                self.stalemate_by_repeat = False
+            elif self.halfmove_clock >= 100:
+                self.stalemate = True
+                self.stalemate_by_fifty_moves = True
+        return moves
+
+    # Same position (pieces, side, rights and en passant) seen this many times in the game
+    def is_repetition(self, times=3):
+        return self.repetition_counts[self.zobrist_key] >= times
+
+    # Only the moves, no checkmate / stalemate bookkeeping. Backends override this one.
+    # Checks and pins are found once from the king, so every generated move is already legal.
+    def get_legal_moves(self):
+        in_check, self.pins, self.checks = self.check_for_pins_and_checks()
+        if self.white_to_move:
+            king_row, king_col = self.white_king_loc
+        else:
+            king_row, king_col = self.black_king_loc
+        moves = []
+        if len(self.checks) > 1:        # double check, only the king can move
+            self.get_king_moves(king_row, king_col, moves)
+            return moves
+        moves = self.get_possible_moves()
+        if in_check:
+            # Single check. Capture the checker, block the line or move the king.
+            check_row, check_col, check_dir_row, check_dir_col = self.checks[0]
+            valid_squares = {(check_row, check_col)}
+            if self.board[check_row][check_col][1] != 'N':      # knights can not be blocked
+                for i in range(1, 8):
+                    square = (king_row + check_dir_row * i, king_col + check_dir_col * i)
+                    valid_squares.add(square)
+                    if square == (check_row, check_col):
+                        break
+            # En passant was already tested against the real board in get_pawn_moves.
+            moves = [move for move in moves if move.piece_moved[1] == 'K' or move.is_enpassant
+                     or (move.end_row, move.end_col) in valid_squares]
+        elif (king_row, king_col) == ((7, 4) if self.white_to_move else (0, 4)):   # Castling moves
+            self.get_castle_moves(king_row, king_col, moves)
+        return moves
+
+    # Moves that follow the piece rules but may leave our own king in check, for search. Pins and checks are not looked
+    # for, make_legal_move throws out the bad ones once a move is actually played.
+    def get_pseudo_legal_moves(self):
+        self.pins = {}
+        self.checks = []
+        moves = self.get_possible_moves()
+        king_row, king_col = self.white_king_loc if self.white_to_move else self.black_king_loc
+        if (king_row, king_col) == ((7, 4) if self.white_to_move else (0, 4)) and not self.in_check():
+            self.get_castle_moves(king_row, king_col, moves)
+        return moves
+
+    # Only the captures and promotions of get_pseudo_legal_moves, for quiescence search. Quiet moves are never built:
+    # pieces look at their target squares for enemies and sliders only at the first piece on each ray.
+    def get_capture_moves(self):
+        self.pins = {}
+        self.checks = []
+        moves = []
+        board = self.board
+        color, enemy = ('w', 'b') if self.white_to_move else ('b', 'w')
+        forward = -1 if self.white_to_move else 1
+        for sq in self.piece_squares[color + 'P']:
+            r, c = sq >> 3, sq & 7
+            end_row = r + forward
+            if (end_row == 0 or end_row == 7) and board[end_row][c] == '--':
+                self.add_pawn_move(r, c, end_row, c, moves)
+            for end_row, end_col in pawn_attack_targets[color][r][c]:
+                if board[end_row][end_col][0] == enemy:
+                    self.add_pawn_move(r, c, end_row, end_col, moves)
+                elif (end_row, end_col) == self.enpassant_possible and self.enpassant_is_legal(r, c, end_row, end_col):
+                    moves.append(pooled_move(r, c, end_row, end_col, board, move_enpassant_flag))
+        for sq in self.piece_squares[color + 'N']:
+            r, c = sq >> 3, sq & 7
+            for end_row, end_col in knight_targets[r][c]:
+                if board[end_row][end_col][0] == enemy:
+                    moves.append(pooled_move(r, c, end_row, end_col, board))
+        for sq in self.piece_squares[color + 'K']:
+            r, c = sq >> 3, sq & 7
+            for end_row, end_col in king_targets[r][c]:
+                if board[end_row][end_col][0] == enemy and not self.king_attacked(end_row, end_col):
+                    moves.append(pooled_move(r, c, end_row, end_col, board))
+        for kind in 'BRQ':
+            for sq in self.piece_squares[color + kind]:
+                r, c = sq >> 3, sq & 7
+                rays = ray_targets[r][c]
+                for d in slider_directions[kind]:
+                    for end_row, end_col in rays[d]:
+                        dest = board[end_row][end_col]
+                        if dest != '--':
+                            if dest[0] == enemy:
+                                moves.append(pooled_move(r, c, end_row, end_col, board))
+                            break
+        return moves
 
-        self.enpassant_possible = temp_enpassant_possible
-        self.castle_rights = temp_castle_rights
+    # The rest of get_pseudo_legal_moves: pushes that do not promote, steps and slides to empty squares and castling.
+    # With get_capture_moves every pseudo legal move comes out exactly once.
+    def get_quiet_moves(self):
+        self.pins = {}
+        self.checks = []
+        moves = []
+        board = self.board
+        color = 'w' if self.white_to_move else 'b'
+        forward = -1 if self.white_to_move else 1
+        start_row = 6 if self.white_to_move else 1
+        for sq in self.piece_squares[color + 'P']:
+            r, c = sq >> 3, sq & 7
+            end_row = r + forward
+            if end_row != 0 and end_row != 7 and board[end_row][c] == '--':
+                moves.append(pooled_move(r, c, end_row, c, board))
+                if r == start_row and board[end_row + forward][c] == '--':
+                    moves.append(pooled_move(r, c, end_row + forward, c, board))
+        for sq in self.piece_squares[color + 'N']:
+            r, c = sq >> 3, sq & 7
+            for end_row, end_col in knight_targets[r][c]:
+                if board[end_row][end_col] == '--':
+                    moves.append(pooled_move(r, c, end_row, end_col, board))
+        for sq in self.piece_squares[color + 'K']:
+            r, c = sq >> 3, sq & 7
+            for end_row, end_col in king_targets[r][c]:
+                if board[end_row][end_col] == '--' and not self.king_attacked(end_row, end_col):
+                    moves.append(pooled_move(r, c, end_row, end_col, board))
+            if (r, c) == ((7, 4) if self.white_to_move else (0, 4)) and not self.in_check():
+                self.get_castle_moves(r, c, moves)
+        for kind in 'BRQ':
+            for sq in self.piece_squares[color + kind]:
+                r, c = sq >> 3, sq & 7
+                rays = ray_targets[r][c]
+                for d in slider_directions[kind]:
+                    for end_row, end_col in rays[d]:
+                        if board[end_row][end_col] != '--':
+                            break
+                        moves.append(pooled_move(r, c, end_row, end_col, board))
         return moves
 
+    # The generated move with the same id as move (from the hash table or a killer slot), or None if the piece on its
+    # start square can not make it here. Only that one piece's moves are generated.
+    def find_move(self, move):
+        piece = self.board[move.start_row][move.start_col]
+        if piece != move.piece_moved or piece[0] != ('w' if self.white_to_move else 'b'):
+            return None
+        self.pins = {}
+        self.checks = []
+        moves = []
+        if move.is_castle_move:
+            if not self.in_check():
+                self.get_castle_moves(move.start_row, move.start_col, moves)
+        else:
+            self.move_list[piece[1]](move.start_row, move.start_col, moves)
+        for generated in moves:
+            if generated.move_id == move.move_id:
+                return generated
+        return None
+
+    # Generator for search: the hash move, then captures and promotions best first (capture_order), then killers, then
+    # the other quiet moves by history score (history is indexed by move_id & move_squares_mask, higher first).
+    # Each stage is only generated when the search gets to it: a cutoff on the hash move costs no generation at all,
+    # one on a capture or killer never builds the quiet moves.
+    # Moves are only pseudo legal, play them with make_legal_move. The position must be back as it was (undo_move)
+    # before the next move is asked for.
+    def staged_moves(self, hash_move=None, killers=(), history=None):
+        played = set()
+        if hash_move is not None:
+            hash_move = self.find_move(hash_move)
+            if hash_move is not None:
+                played.add(hash_move.move_id)
+                yield hash_move
+        captures = self.get_capture_moves()
+        captures.sort(key=capture_order, reverse=True)
+        for move in captures:
+            if move.move_id not in played:
+                yield move
+        for killer in killers:
+            if killer is None or killer.move_id in played:
+                continue
+            # A killer is a quiet move from a sibling, here its square may hold a piece and it was a capture above
+            move = self.find_move(killer)
+            if move is not None and move.piece_captured == '--' and not move.is_pawn_promotion:
+                played.add(move.move_id)
+                yield move
+        quiets = self.get_quiet_moves()
+        if history is not None:
+            quiets.sort(key=lambda move: history[move.move_id & move_squares_mask], reverse=True)
+        for move in quiets:
+            if move.move_id not in played:
+                yield move
+
+    # Plays the move if it does not leave our own king attacked, otherwise puts the position back and returns False.
+    # With the attack maps the test is one lookup.
+    def make_legal_move(self, move):
+        self.make_move(move)
+        if self.white_to_move:      # black just moved
+            king_row, king_col = self.black_king_loc
+            attacked = self.attack_counts['w'][king_row * 8 + king_col]
+        else:
+            king_row, king_col = self.white_king_loc
+            attacked = self.attack_counts['b'][king_row * 8 + king_col]
+        if attacked:
+            self.undo_move(False)
+            return False
+        return True
+
+    # Walk out from the king once. Returns (in check, {pinned square: pin direction}, [(row, col, dir row, dir col)])
+    def check_for_pins_and_checks(self):
+        pins = {}
+        checks = []
+        in_check = False
+        if self.white_to_move:
+            enemy, ally = 'b', 'w'
+            start_row, start_col = self.white_king_loc
+        else:
+            enemy, ally = 'w', 'b'
+            start_row, start_col = self.black_king_loc
+        # Rook directions first, then bishop directions
+        rays = ray_targets[start_row][start_col]
+        for j in range(8):
+            d = directions[j]
+            possible_pin = ()
+            i = 0
+            for end_row, end_col in rays[j]:
+                i += 1
+                end_piece = self.board[end_row][end_col]
+                if end_piece[0] == ally:
+                    if possible_pin == ():      # first ally piece could be pinned
+                        possible_pin = (end_row, end_col)
+                    else:                       # second ally piece, so no pin or check this way
+                        break
+                elif end_piece[0] == enemy:
+                    kind = end_piece[1]
+                    # Pawns only attack one square diagonally forward (towards the king's side of the board)
+                    if (j <= 3 and kind == 'R') or (j >= 4 and kind == 'B') or kind == 'Q' or \
+                            (i == 1 and kind == 'P' and ((enemy == 'w' and j >= 6) or (enemy == 'b' and 4 <= j <= 5))):
+                        if possible_pin == ():
+                            in_check = True
+                            checks.append((end_row, end_col, d[0], d[1]))
+                        else:
+                            pins[possible_pin] = d
+                    break                       # enemy piece blocks the rest of the line either way
+        for end_row, end_col in knight_targets[start_row][start_col]:
+            end_piece = self.board[end_row][end_col]
+            if end_piece[0] == enemy and end_piece[1] == 'N':
+                in_check = True
+                checks.append((end_row, end_col, end_row - start_row, end_col - start_col))
+        return in_check, pins, checks
+
+    # A pinned piece may still slide along its pin line, towards the king or the pinner.
+    def pin_allows(self, r, c, direction):
+        pin = self.pins.get((r, c))
+        return pin is None or pin == direction or (pin[0] == -direction[0] and pin[1] == -direction[1])
+
+    # En passant takes two pawns off the same rank at once, which the pin scan can not see. Try it on the board.
+    def enpassant_is_legal(self, r, c, end_row, end_col):
+        pawn = self.board[r][c]
+        captured = self.board[r][end_col]
+        self.board[r][c] = '--'
+        self.board[r][end_col] = '--'
+        self.board[end_row][end_col] = pawn
+        # The attack maps do not see these writes, so look from the king on the board itself
+        if self.white_to_move:
+            attacked = self.king_attacked_on_board(self.white_king_loc[0], self.white_king_loc[1])
+        else:
+            attacked = self.king_attacked_on_board(self.black_king_loc[0], self.black_king_loc[1])
+        self.board[end_row][end_col] = '--'
+        self.board[r][end_col] = captured
+        self.board[r][c] = pawn
+        return not attacked
+
     def update_castle_rights(self, move):
         if move.piece_moved == 'wK':
             self.castle_rights.wks = False
             self.castle_rights.wqs = False
         elif move.piece_moved == 'bK':
             self.castle_rights.bks = False
-            self.castle_rights.bks = False
+            self.castle_rights.bqs = False
         elif move.piece_moved == 'wR':
             if move.start_row == 7:
                 if move.start_col == 0:     # Left rook
@@ -218,231 +821,252 @@ class GameState():
                 elif move.start_col == 7:   # Right rook
                     self.castle_rights.wks = False
         elif move.piece_moved == 'bR':
-            if move.start_row == 7:
+            if move.start_row == 0:
                 if move.start_col == 0:     # Left rook
                     self.castle_rights.bqs = False
                 elif move.start_col == 7:   # Right rook
                     self.castle_rights.bks = False
-        # if rook got captured
+        # if rook got captured. The rook is on the end square of the capturing move
         if move.piece_captured == 'wR':
-            if move.start_row == 7:
-                if move.start_col == 0:  # Left rook
+            if move.end_row == 7:
+                if move.end_col == 0:  # Left rook
                     self.castle_rights.wqs = False
-                elif move.start_col == 7:  # Right rook
+                elif move.end_col == 7:  # Right rook
                     self.castle_rights.wks = False
         elif move.piece_captured == 'bR':
-            if move.start_row == 7:
-                if move.start_col == 0:  # Left rook
+            if move.end_row == 0:
+                if move.end_col == 0:  # Left rook
                     self.castle_rights.bqs = False
-                elif move.start_col == 7:  # Right rook
+                elif move.end_col == 7:  # Right rook
                     self.castle_rights.bks = False
 
     def in_check(self):
         if self.white_to_move:
-            return self.king_attacked(self.white_king_loc[0], self.white_king_loc[1])
+            return self.attack_counts['b'][self.white_king_loc[0] * 8 + self.white_king_loc[1]] > 0
         else:
-            return self.king_attacked(self.black_king_loc[0], self.black_king_loc[1])
-
-    # where opposite color can attack
+            return self.attack_counts['w'][self.black_king_loc[0] * 8 + self.black_king_loc[1]] > 0
 
+    # Is the square attacked by the opposite color. A lookup in the attack maps, so only valid on the real board.
     def king_attacked(self, r, c):
+        return self.attack_counts['b' if self.white_to_move else 'w'][r * 8 + c] > 0
+
+    # Pieces on the board, kings included
+    def piece_count(self):
+        return 64 - self.squares.count('--')
+
+    # Squares (row * 8 + col) the piece stands on
+    def squares_of(self, piece):
+        return self.piece_squares[piece]
+
+    # Anything besides king and pawns, without which passing the turn (null move) is not safe to assume is worse
+    def has_non_pawn_material(self, color):
+        return any(self.piece_squares[color + kind] for kind in 'NBRQ')
+
+    # Least valuable piece of color attacking sq as (square, piece), or None. Squares in removed count as empty, so a
+    # slider behind a piece that already took part in an exchange joins in.
+    def least_valuable_attacker(self, sq, color, removed):
+        squares = self.squares
+        pawn = color + 'P'
+        for s in pawn_attack_squares['b' if color == 'w' else 'w'][sq]:    # where a pawn of color would hit sq from
+            if squares[s] == pawn and s not in removed:
+                return s, pawn
+        knight = color + 'N'
+        for s in knight_squares[sq]:
+            if squares[s] == knight and s not in removed:
+                return s, knight
+        best = None
+        rays = ray_squares[sq]
+        for d in range(8):
+            for s in rays[d]:
+                piece = squares[s]
+                if piece == '--' or s in removed:
+                    continue
+                if piece[0] == color and piece in line_pieces[d] and (
+                        best is None or piece_score[piece[1]] < piece_score[best[1][1]]):
+                    best = s, piece
+                break
+        if best is not None:
+            return best
+        king = color + 'K'
+        for s in king_squares[sq]:
+            if squares[s] == king and s not in removed:
+                return s, king
+        return None
+
+    # Static exchange evaluation of a capture: the centipawns the side to move is up once both sides have taken back
+    # on the target square with their least valuable piece for as long as it pays. Pins, checks and promotions are
+    # not looked at.
+    def static_exchange(self, move):
+        sq = move.end_row * 8 + move.end_col
+        removed = {move.start_row * 8 + move.start_col}
+        gains = [piece_score[move.piece_captured[1]] if move.piece_captured != '--' else 0]
+        on_square = piece_score[move.piece_moved[1]]
+        color = 'b' if self.white_to_move else 'w'
+        while True:
+            attacker = self.least_valuable_attacker(sq, color, removed)
+            if attacker is None:
+                break
+            attacker_sq, piece = attacker
+            other = 'w' if color == 'b' else 'b'
+            if piece[1] == 'K' and self.least_valuable_attacker(sq, other, removed | {attacker_sq}) is not None:
+                break       # the king can only take a piece nothing defends
+            gains.append(on_square - gains[-1])
+            on_square = piece_score[piece[1]]
+            removed.add(attacker_sq)
+            color = other
+        # Going back from the last capture, each side only takes if that beats stopping
+        for i in range(len(gains) - 1, 0, -1):
+            gains[i - 1] = -max(-gains[i - 1], gains[i])
+        return gains[0]
+
+    # Same question answered by walking out from the square. For boards changed without set_square.
+    def king_attacked_on_board(self, r, c):
         enemy = 'b' if self.white_to_move else 'w'
-        # Pawn check
-        if self.white_to_move:  # If White King
-            if c + 1 <= 7:  # If not on right edge of board, can be attacked from top right
-                dest = self.board[r - 1][c + 1]
-                if dest[0] == enemy and dest[1] == 'P':
-                    return True
-            if c - 1 >= 0:  # If not left edge of board, can be attacked from top left
-                dest = self.board[r - 1][c - 1]
-                if dest[0] == enemy and dest[1] == 'P':
-                    return True
-        else:
-            if c + 1 <= 7:  # If not on right edge of board, can be attacked from top right
-                dest = self.board[r + 1][c + 1]
-                if dest[0] == enemy and dest[1] == 'P':
-                    return True
-            if c - 1 >= 0:  # If not left edge of board, can be attacked from top left
-                dest = self.board[r + 1][c - 1]
-                if dest[0] == enemy and dest[1] == 'P':
-                    return True
+        # Pawn check. An enemy pawn hits us from the squares our own pawn would attack from here.
+        for end_row, end_col in pawn_attack_targets['w' if self.white_to_move else 'b'][r][c]:
+            dest = self.board[end_row][end_col]
+            if dest[0] == enemy and dest[1] == 'P':
+                return True
         # King Check
-        king_movement = ((-1, -1), (-1, 1), (1, 1), (1, -1), (-1, 0), (0, 1), (1, 0), (0, -1))
-        for m in king_movement:
-            end_row = r + (m[0])
-            end_col = c + (m[1])
-            if 0 <= end_row <= 7 and 0 <= end_col <= 7:
+        for end_row, end_col in king_targets[r][c]:
+            dest = self.board[end_row][end_col]
+            if dest[0] == enemy and dest[1] == 'K':
+                return True
+
+        rays = ray_targets[r][c]
+        for d in range(8):
+            # Rook and Queen on the first 4 directions, Bishop and Queen on the last 4
+            slider = 'R' if d < 4 else 'B'
+            for end_row, end_col in rays[d]:
                 dest = self.board[end_row][end_col]
-                if dest[0] == enemy and dest[1] == 'K':
+                if dest[0] == enemy and (dest[1] == slider or dest[1] == 'Q'):
                     return True
-                elif dest != "--":                          # An ally or some other piece
-                    break
-            else:
-                break
-
-        rook_movement = ((-1, 0), (0, -1), (1, 0), (0, 1))  # Rook and Queen
-        for m in rook_movement:
-            for i in range(1, 8):
-                end_row = r + (m[0] * i)
-                end_col = c + (m[1] * i)
-                if 0 <= end_row <= 7 and 0 <= end_col <= 7:
-                    dest = self.board[end_row][end_col]
-                    if dest[0] == enemy and (dest[1] == 'R' or dest[1] == 'Q'):
-                        return True
-                    elif dest != "--":                       # An ally or some other piece
-                        break
-                else:
-                    break
-        bishop_movement = ((-1, -1), (-1, 1), (1, 1), (1, -1))  # Bishop and Queen
-        for m in bishop_movement:
-            for i in range(1, 8):
-                end_row = r + (m[0] * i)
-                end_col = c + (m[1] * i)
-                if 0 <= end_row <= 7 and 0 <= end_col <= 7:
-                    dest = self.board[end_row][end_col]
-                    if dest[0] == enemy and (dest[1] == 'B' or dest[1] == 'Q'):
-                        return True
-                    elif dest != "--":                       # An ally or some other piece
-                        break
-                else:
+                elif dest != "--":                       # An ally or some other piece
                     break
 
-        knight_movement = ((-2, -1), (-2, 1), (2, -1), (2, 1), (-1, 2), (-1, -2), (1, 2), (1, -2))
-        for m in knight_movement:
-            end_row = r + m[0]
-            end_col = c + m[1]
-            if 0 <= end_row <= 7 and 0 <= end_col <= 7:
-                dest = self.board[end_row][end_col]
-                if dest[0] == enemy and dest[1] == 'N':  # if enemy knight is in the spot
-                    return True
+        for end_row, end_col in knight_targets[r][c]:
+            dest = self.board[end_row][end_col]
+            if dest[0] == enemy and dest[1] == 'N':  # if enemy knight is in the spot
+                return True
         return False
 
     def get_possible_moves(self):  # for legal moves.
-        # In the future, try making it so it only checks on pieces you click maybe
+        # Only the squares our pieces are on, not the whole board
         moves = []
-        for r in range(len(self.board)):
-            for c in range(len(self.board[r])):
-                color = self.board[r][c][0]
-                if (color == "w" and self.white_to_move) or (color == 'b' and not self.white_to_move):  # if their turn
-                    piece = self.board[r][c][1]
-                    self.move_list[piece](r, c, moves)
+        color = 'w' if self.white_to_move else 'b'
+        for kind in 'PNBRQK':
+            get_moves = self.move_list[kind]
+            for sq in self.piece_squares[color + kind]:
+                get_moves(sq >> 3, sq & 7, moves)
         return moves
 
     def get_pawn_moves(self, r, c, moves):
         if self.white_to_move:
-            if self.board[r - 1][c] == "--":
-                moves.append(Move((r, c), (r - 1, c), self.board))
+            if self.board[r - 1][c] == "--" and self.pin_allows(r, c, (-1, 0)):
+                self.add_pawn_move(r, c, r - 1, c, moves)
                 if r == 6 and self.board[r - 2][c] == "--":
-                    moves.append(Move((r, c), (r - 2, c), self.board))
-            if c + 1 <= 7:  # If not at Right
+                    moves.append(pooled_move(r, c, r - 2, c, self.board))
+            if c + 1 <= 7 and self.pin_allows(r, c, (-1, 1)):  # If not at Right
                 if self.board[r - 1][c + 1][0] == 'b':
-                    moves.append(Move((r, c), (r - 1, c + 1), self.board))
-                elif (r - 1, c + 1) == self.enpassant_possible:                # checking if move is same as enpassant square
-                    moves.append(Move((r, c), (r - 1, c + 1), self.board, enpassant_flag=True))
-            if c - 1 >= 0:  # Left
+                    self.add_pawn_move(r, c, r - 1, c + 1, moves)
+                elif (r - 1, c + 1) == self.enpassant_possible and self.enpassant_is_legal(r, c, r - 1, c + 1):
+                    moves.append(pooled_move(r, c, r - 1, c + 1, self.board, move_enpassant_flag))
+            if c - 1 >= 0 and self.pin_allows(r, c, (-1, -1)):  # Left
                 if self.board[r - 1][c - 1][0] == 'b':
-                    moves.append(Move((r, c), (r - 1, c - 1), self.board))
-                elif (r - 1, c - 1) == self.enpassant_possible:                                       # en passant
-                    moves.append(Move((r, c), (r - 1, c - 1), self.board, enpassant_flag=True))
+                    self.add_pawn_move(r, c, r - 1, c - 1, moves)
+                elif (r - 1, c - 1) == self.enpassant_possible and self.enpassant_is_legal(r, c, r - 1, c - 1):
+                    moves.append(pooled_move(r, c, r - 1, c - 1, self.board, move_enpassant_flag))
 
         else:  # Black
-            if self.board[r + 1][c] == "--":
-                moves.append(Move((r, c), (r + 1, c), self.board))
+            if self.board[r + 1][c] == "--" and self.pin_allows(r, c, (1, 0)):
+                self.add_pawn_move(r, c, r + 1, c, moves)
                 if r == 1 and self.board[r + 2][c] == "--":
-                    moves.append(Move((r, c), (r + 2, c), self.board))
-            if c + 1 <= 7:  # Right
+                    moves.append(pooled_move(r, c, r + 2, c, self.board))
+            if c + 1 <= 7 and self.pin_allows(r, c, (1, 1)):  # Right
                 if self.board[r + 1][c + 1][0] == 'w':
-                    moves.append(Move((r, c), (r + 1, c + 1), self.board))
-                elif (r + 1, c + 1) == self.enpassant_possible:                # checking if move is same as enpassant square
-                    moves.append(Move((r, c), (r + 1, c + 1), self.board, enpassant_flag=True))
-            if c - 1 >= 0:  # Left
+                    self.add_pawn_move(r, c, r + 1, c + 1, moves)
+                elif (r + 1, c + 1) == self.enpassant_possible and self.enpassant_is_legal(r, c, r + 1, c + 1):
+                    moves.append(pooled_move(r, c, r + 1, c + 1, self.board, move_enpassant_flag))
+            if c - 1 >= 0 and self.pin_allows(r, c, (1, -1)):  # Left
                 if self.board[r + 1][c - 1][0] == 'w':
-                    moves.append(Move((r, c), (r + 1, c - 1), self.board))
-                elif (r + 1, c - 1) == self.enpassant_possible:                                       # en passant
-                    moves.append(Move((r, c), (r + 1, c - 1), self.board, enpassant_flag=True))
+                    self.add_pawn_move(r, c, r + 1, c - 1, moves)
+                elif (r + 1, c - 1) == self.enpassant_possible and self.enpassant_is_legal(r, c, r + 1, c - 1):
+                    moves.append(pooled_move(r, c, r + 1, c - 1, self.board, move_enpassant_flag))
+
+    # Reaching the last rank gives one move per promotion piece. Queen first so a plain click in main.py picks it.
+    def add_pawn_move(self, r, c, end_row, end_col, moves):
+        if end_row == 0 or end_row == 7:
+            for i in range(1, len(promotion_pieces)):
+                moves.append(pooled_move(r, c, end_row, end_col, self.board, i << promotion_shift))
+        else:
+            moves.append(pooled_move(r, c, end_row, end_col, self.board))
 
     def get_rook_moves(self, r, c, moves):
-        movement = ((-1, 0), (0, -1), (1, 0), (0, 1))  # up, left, down, right
-        opposite_color = 'b' if self.white_to_move else 'w'
-        for m in movement:
-            for i in range(1, 8):
-                dest_row = r + (m[0] * i)   # row + direction increment.
-                dest_col = c + (m[1] * i)   # column + direction increment.
-                if 0 <= dest_row <= 7 and 0 <= dest_col <= 7:  # in bounds
-                    dest = self.board[dest_row][dest_col]
-                    if dest == "--":
-                        moves.append(Move((r, c), (dest_row, dest_col), self.board))
-                    elif dest[0] == opposite_color:  # If opposite color, can capture then stop
-                        moves.append(Move((r, c), (dest_row, dest_col), self.board))
-                        break
-                    else:  # if same color, stop
-                        break
-                else:  # counting out of bounds
-                    break
+        self.get_slider_moves(r, c, range(4), moves)     # up, left, down, right
 
     def get_knight_moves(self, r, c, moves):
-        movement = ((-2, -1), (-2, 1), (2, -1), (2, 1), (-1, 2), (-1, -2), (1, 2), (1, -2))  # Knight 8 spots
+        if (r, c) in self.pins:     # a pinned knight can never stay on the pin line
+            return
         color = 'w' if self.white_to_move else 'b'
-        for m in movement:
-            dest_row = r + m[0]  # row + direction increment.
-            dest_col = c + m[1]  # column + direction increment.
-            if 0 <= dest_row <= 7 and 0 <= dest_col <= 7:  # in bounds
-                dest = self.board[dest_row][dest_col]
-                if dest[0] != color:
-                    moves.append(Move((r, c), (dest_row, dest_col), self.board))
+        for dest_row, dest_col in knight_targets[r][c]:
+            if self.board[dest_row][dest_col][0] != color:
+                moves.append(pooled_move(r, c, dest_row, dest_col, self.board))
 
     def get_bishop_moves(self, r, c, moves):
-        movement = ((-1, -1), (-1, 1), (1, 1), (1, -1))  # SW, SE, NE, NW
+        self.get_slider_moves(r, c, range(4, 8), moves)  # the four diagonals
+
+    # Walk the precomputed rays for each direction index until a piece stops the slider
+    def get_slider_moves(self, r, c, direction_indexes, moves):
         opposite_color = 'b' if self.white_to_move else 'w'
-        for m in movement:
-            for i in range(1, 8):
-                dest_row = r + (m[0] * i)  # row + direction increment.
-                dest_col = c + (m[1] * i)  # column + direction increment.
-                if 0 <= dest_row <= 7 and 0 <= dest_col <= 7:  # in bounds
-                    dest = self.board[dest_row][dest_col]
-                    if dest == "--":
-                        moves.append(Move((r, c), (dest_row, dest_col), self.board))
-                    elif dest[0] == opposite_color:  # If opposite color, can capture then stop
-                        moves.append(Move((r, c), (dest_row, dest_col), self.board))
-                        break
-                    else:  # if same color, stop
-                        break
-                else:  # counting out of bounds
+        board = self.board
+        rays = ray_targets[r][c]
+        for d in direction_indexes:
+            if self.pins and not self.pin_allows(r, c, directions[d]):
+                continue
+            for dest_row, dest_col in rays[d]:
+                dest = board[dest_row][dest_col]
+                if dest == "--":
+                    moves.append(pooled_move(r, c, dest_row, dest_col, board))
+                elif dest[0] == opposite_color:  # If opposite color, can capture then stop
+                    moves.append(pooled_move(r, c, dest_row, dest_col, board))
+                    break
+                else:  # if same color, stop
                     break
 
     def get_queen_moves(self, r, c, moves):
-        self.get_rook_moves(r, c, moves)
-        self.get_bishop_moves(r, c, moves)
+        self.get_slider_moves(r, c, range(8), moves)
 
     def get_king_moves(self, r, c, moves):
-        movement = ((-1, -1), (-1, 1), (1, 1), (1, -1), (-1, 0), (0, 1), (1, 0), (0, -1))  # SW, SE, NE, NW, S, E, N, W
         color = 'w' if self.white_to_move else 'b'
-        for m in movement:
-            dest_row = r + m[0]  # row + direction increment.
-            dest_col = c + m[1]  # column + direction increment.
-            if 0 <= dest_row <= 7 and 0 <= dest_col <= 7:  # in bounds
-                dest = self.board[dest_row][dest_col]
-                if dest[0] != color:
-                    moves.append(Move((r, c), (dest_row, dest_col), self.board))
+        targets = [target for target in king_targets[r][c] if self.board[target[0]][target[1]][0] != color]
+        # The king blocks a slider that checks it, so the square behind the king on that line is not in the attack
+        # maps yet. Stepping there would still be check.
+        for check_row, check_col, check_dir_row, check_dir_col in self.checks:
+            if self.board[check_row][check_col][1] in 'RBQ' and (r - check_dir_row, c - check_dir_col) in targets:
+                targets.remove((r - check_dir_row, c - check_dir_col))
+        for target in targets:
+            if not self.king_attacked(target[0], target[1]):
+                moves.append(pooled_move(r, c, target[0], target[1], self.board))
 
     def get_castle_moves(self, r, c, moves):
-        # can't castle while we are in check
-        if self.in_check():
-            return
+        # can't castle while we are in check. get_legal_moves only calls this when not in check
         if (self.white_to_move and self.castle_rights.wks) or (not self.white_to_move and self.castle_rights.bks):
             self.get_king_side_castle_moves(r, c, moves)
         if (self.white_to_move and self.castle_rights.wqs) or (not self.white_to_move and self.castle_rights.bqs):
             self.get_queen_side_castle_moves(r, c, moves)
 
+    # The rook has to still be in its corner as well, castle rights alone are not trusted here.
     def get_king_side_castle_moves(self, r, c, moves):
-        if self.board[r][c + 1] == '--' and self.board[r][c + 2] == '--':
+        if self.board[r][c + 1] == '--' and self.board[r][c + 2] == '--' and self.board[r][c + 3][1] == 'R' \
+                and self.board[r][c + 3][0] == self.board[r][c][0]:
             if not self.king_attacked(r, c + 1) and not self.king_attacked(r, c + 2):
-                moves.append(Move((r, c), (r, c + 2), self.board, is_castle_move=True))
+                moves.append(pooled_move(r, c, r, c + 2, self.board, move_castle_flag))
 
     def get_queen_side_castle_moves(self, r, c, moves):
-        if self.board[r][c - 1] == '--' and self.board[r][c - 2] == '--' and self.board[r][c - 3] == '--':
+        if self.board[r][c - 1] == '--' and self.board[r][c - 2] == '--' and self.board[r][c - 3] == '--' \
+                and self.board[r][c - 4][1] == 'R' and self.board[r][c - 4][0] == self.board[r][c][0]:
             if not self.king_attacked(r, c - 1) and not self.king_attacked(r, c - 2):
-                moves.append(Move((r, c), (r, c - 2), self.board, is_castle_move=True))
+                moves.append(pooled_move(r, c, r, c - 2, self.board, move_castle_flag))
 
 
 class Castle:
@@ -452,8 +1076,113 @@ class Castle:
         self.wqs = wqs
         self.bqs = bqs
 
+    # 4 bit form of the rights, used for hashing and the undo stack
+    def bits(self):
+        return self.wks | self.wqs << 1 | self.bks << 2 | self.bqs << 3
+
+    def set_bits(self, bits):
+        self.wks = bits & 1 != 0
+        self.wqs = bits & 2 != 0
+        self.bks = bits & 4 != 0
+        self.bqs = bits & 8 != 0
+
+
+# The legal moves of one position, indexed by start square and by (start, end) squares for the UI.
+class MoveSet:
+    __slots__ = ('moves', 'by_start', 'by_squares')
+
+    def __init__(self, moves):
+        self.moves = moves
+        self.by_start = {}
+        self.by_squares = {}
+        for move in moves:
+            self.by_start.setdefault((move.start_row, move.start_col), []).append(move)
+            self.by_squares.setdefault((move.start_row, move.start_col, move.end_row, move.end_col), []).append(move)
+
+    def from_square(self, r, c):
+        return self.by_start.get((r, c), ())
+
+    # The move between two squares, or None. Promotions give four moves for the same squares, the queen comes first.
+    def find(self, start_row, start_col, end_row, end_col):
+        moves = self.by_squares.get((start_row, start_col, end_row, end_col))
+        return moves[0] if moves else None
+
+
+# Least recently used cache of MoveSets keyed by zobrist key. One shared instance per process, see legal_move_cache.
+class LegalMoveCache:
+    def __init__(self, size=2048):
+        self.size = size
+        self.entries = OrderedDict()
+
+    def get(self, gamestate):
+        key = gamestate.zobrist_key
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = MoveSet(gamestate.get_legal_moves())
+            self.entries[key] = entry
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        else:
+            self.entries.move_to_end(key)
+        return entry
+
+    def clear(self):
+        self.entries.clear()
+
+
+legal_move_cache = LegalMoveCache()
+
+
+# Packed move id: bits 0-5 start square, 6-11 end square (row * 8 + col), bit 12 en passant, bit 13 castle,
+# bits 14-16 promotion piece as an index into promotion_pieces. Fits in 17 bits so it is cheap to store and compare.
+move_squares_mask = 0xFFF
+move_enpassant_flag = 1 << 12
+move_castle_flag = 1 << 13
+promotion_shift = 14
+promotion_pieces = ('', 'Q', 'R', 'B', 'N')
+piece_codes = {'--': 0, 'wP': 1, 'wN': 2, 'wB': 3, 'wR': 4, 'wQ': 5, 'wK': 6,
+               'bP': 7, 'bN': 8, 'bB': 9, 'bR': 10, 'bQ': 11, 'bK': 12}
+piece_names = ('--',) + pieces      # piece_codes the other way round
+# MVV-LVA: most valuable victim first, then least valuable attacker. A promotion counts as taking the new piece.
+capture_values = {'-': 0, 'P': 1, 'N': 2, 'B': 3, 'R': 4, 'Q': 5, 'K': 6}
+
+
+def capture_order(move):
+    order = capture_values[move.piece_captured[1]] * 8 - capture_values[move.piece_moved[1]]
+    if move.is_pawn_promotion:
+        order += capture_values[move.promotion_piece] * 8
+    return order
+
+
+# A Move only depends on its id and the two pieces involved, and is never changed after it is made, so the generators
+# hand out one shared object per combination instead of building millions of new ones during a search.
+move_pool = {}
+move_pool_limit = 200000
+
+
+def pooled_move(start_row, start_col, end_row, end_col, board, flags=0):
+    key = (start_row << 3 | start_col | (end_row << 3 | end_col) << 6 | flags
+           | piece_codes[board[start_row][start_col]] << 17 | piece_codes[board[end_row][end_col]] << 21)
+    move = move_pool.get(key)
+    if move is None:
+        if len(move_pool) >= move_pool_limit:
+            move_pool.clear()
+        move = Move((start_row, start_col), (end_row, end_col), board, flags & move_enpassant_flag != 0,
+                    flags & move_castle_flag != 0, promotion_pieces[flags >> promotion_shift] or 'Q')
+        move_pool[key] = move
+    return move
+
+
+# Turn a stored move id (transposition table, killer slots, ...) back into a Move for the given board
+def move_from_id(move_id, board):
+    start = move_id & 63
+    end = move_id >> 6 & 63
+    return pooled_move(start >> 3, start & 7, end >> 3, end & 7, board, move_id & ~move_squares_mask)
+
 
 class Move():
+    __slots__ = ('start_row', 'start_col', 'end_row', 'end_col', 'piece_moved', 'piece_captured', 'is_capture',
+                 'is_pawn_promotion', 'promotion_piece', 'is_enpassant', 'is_castle_move', 'move_id')
     # changing values to match chess board
     ranks_to_row = {"1": 7, "2": 6, "3": 5, "4": 4, "5": 3, "6": 2, "7": 1, "8": 0}
     rows_to_rank = {v: k for k, v in ranks_to_row.items()}
@@ -462,7 +1191,7 @@ class Move():
 
     # Reformatting using items. Goes from dict_items([('a', 0,  ('b', 1), ...)] to {0: a, 1: b, ...}
     # start square, end square, board, optional flags.
-    def __init__(self, start, end, board, enpassant_flag=False, is_castle_move=False):
+    def __init__(self, start, end, board, enpassant_flag=False, is_castle_move=False, promotion_piece='Q'):
         self.start_row = start[0]
         self.start_col = start[1]
         self.end_row = end[0]
@@ -478,6 +1207,7 @@ class Move():
             self.piece_captured = 'wP' if self.piece_moved == 'bP' else 'bP'
 
         self.is_castle_move = is_castle_move
+        self.promotion_piece = promotion_piece if self.is_pawn_promotion else ''
 
         """
         The pawn promotion is the same as:
@@ -485,14 +1215,27 @@ class Move():
         if (self.piece_moved == 'wP' and self.end_row == 0) or (self.piece_moved == 'bP' and self.end_row == 7):
             self.is_pawn_promotion = True
         """
+        self.move_id = (self.start_row << 3 | self.start_col | (self.end_row << 3 | self.end_col) << 6
+                        | promotion_pieces.index(self.promotion_piece) << promotion_shift)
+        if enpassant_flag:
+            self.move_id |= move_enpassant_flag
+        if is_castle_move:
+            self.move_id |= move_castle_flag
 
-    # Overriding equal methods to allow an object to compare to another object since I am using class objects
-    # instead of directly using numbers for the moves
+    # Overriding equal methods to allow an object to compare to another object. Compares the packed ids, so two moves
+    # are equal when squares, flags and promotion piece all match.
     def __eq__(self, other):
-        if isinstance(other, Move):  # Making sure they are both objects of the class. Going to compare chess notation
-            return self.get_chess_notation() == other.get_chess_notation()
+        if isinstance(other, Move):  # Making sure they are both objects of the class.
+            return self.move_id == other.move_id
         return False
 
+    def __hash__(self):
+        return self.move_id
+
+    # Same start and end square, ignoring flags. Used to match a clicked move against the generated ones.
+    def same_squares(self, other):
+        return (self.move_id ^ other.move_id) & move_squares_mask == 0
+
     # Overriding str() function
     def __str__(self):
         # castle move
@@ -504,10 +1247,8 @@ class Move():
         if self.piece_moved[1] == 'P':
             if self.is_capture or self.is_enpassant:
                 end_square = self.cols_to_files[self.start_col] + 'x' + end_square
-            if self.end_row == 0 and self.piece_moved[0] == 'w':
-                return end_square + "=Q"                            # For now only Q for Queen.
-            elif self.end_row == 7 and self.piece_moved[0] == 'b':
-                return end_square + "=Q"
+            if self.is_pawn_promotion:
+                return end_square + "=" + self.promotion_piece
             else:
                 return end_square
 
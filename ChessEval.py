@@ -0,0 +1,49 @@
+# Evaluation tables in integer centipawns (100 = one pawn). GameState keeps a running total from these in set_square,
+# so ChessAI reads the score of a position instead of adding it up. Kept apart from ChessAI so ChessEngine can use
+# them without importing the AI.
+
+piece_score = {"K": 0, "Q": 950, "R": 500, "B": 330, "N": 300, "P": 100}
+
+# This is denoting point value for pawns in certain positions. Value in terms of white in my view
+pawn_table = [
+            [0, 0, 0, 0, 0, 0, 0, 0],
+            [700, 700, 700, 700, 700, 700, 700, 700],
+            [400, 400, 400, 400, 400, 400, 400, 400],
+            [150, 150, 200, 200, 200, 200, 150, 150],
+            [0, 0, 50, 200, 200, 50, 0, 0],
+            [50, 0, 0, 100, 100, 0, 0, 50],
+            [50, 50, 100, 100, 100, 100, 50, 50],
+            [0, 0, 0, 0, 0, 0, 0, 0]
+        ]
+
+knight_table = [
+        [0, 0, 0, 0, 0, 0, 0, 0],
+        [0, 0, 0, 0, 0, 0, 0, 0],
+        [0, 50, 100, 200, 200, 100, 50, 0],
+        [0, 0, 100, 200, 200, 100, 0, 0],
+        [0, 0, 100, 100, 100, 100, 0, 0],
+        [0, 0, 100, 100, 100, 100, 0, 0],
+        [0, 0, 0, 0, 0, 0, 0, 0],
+        [0, 0, 0, 0, 0, 0, 0, 0]
+    ]
+
+table_dictionaries = {"P": pawn_table, "N": knight_table}
+
+
+# piece -> 64 values (square row * 8 + col) of material plus table bonus from white's view, so black pieces are
+# negative and read their table upside down. '--' is all zeros so a board write can always add new minus old.
+def build_piece_square_values():
+    values = {'--': [0] * 64}
+    for color, sign in (('w', 1), ('b', -1)):
+        for kind, score in piece_score.items():
+            table = table_dictionaries.get(kind)
+            squares = []
+            for sq in range(64):
+                r, c = divmod(sq, 8)
+                bonus = table[r if color == 'w' else 7 - r][c] if table is not None else 0
+                squares.append(sign * (score + bonus))
+            values[color + kind] = squares
+    return values
+
+
+piece_square_values = build_piece_square_values()
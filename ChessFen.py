@@ -0,0 +1,124 @@
+# Streaming FEN / EPD input and output for bulk jobs. Files are read and written one line at a time, so memory stays
+# flat on multi-gigabyte files, and every position goes straight into GameState.load_fen instead of replaying moves.
+#
+# for gamestate, operations in ChessFen.read_game_states("positions.epd.gz"):
+#     score = ChessAI.score_board(gamestate)
+
+import gzip
+
+import ChessEngine
+
+
+def open_text(path, mode='rt'):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode, encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+# Split on ';' that are not inside a quoted operand
+def _split_operations(text):
+    parts = []
+    current = ''
+    quoted = False
+    for char in text:
+        if char == '"':
+            quoted = not quoted
+        if char == ';' and not quoted:
+            parts.append(current)
+            current = ''
+        else:
+            current += char
+    parts.append(current)
+    return parts
+
+
+# 'bm e4; id "start";' -> {'bm': 'e4', 'id': 'start'}. Operands stay as one string, quotes removed.
+def parse_operations(text):
+    operations = {}
+    for part in _split_operations(text):
+        part = part.strip()
+        if part:
+            opcode, _, operand = part.partition(' ')
+            operand = operand.strip()
+            if len(operand) >= 2 and operand[0] == '"' and operand[-1] == '"':
+                operand = operand[1:-1]
+            operations[opcode] = operand
+    return operations
+
+
+def format_operations(operations):
+    text = []
+    for opcode, operand in operations.items():
+        operand = str(operand)
+        if operand == '':
+            text.append(opcode + ';')
+        elif ' ' in operand or ';' in operand:
+            text.append(opcode + ' "' + operand + '";')
+        else:
+            text.append(opcode + ' ' + operand + ';')
+    return ' '.join(text)
+
+
+# Accepts a plain FEN (6 fields, clocks optional) or an EPD line (4 fields then operations).
+# Returns (full 6 field FEN, operations). EPD clocks come from the hmvc / fmvn operations when present.
+def parse_line(line):
+    fields = line.split(None, 4)
+    if len(fields) < 4:
+        raise ValueError("Not a FEN or EPD line: " + line)
+    rest = fields[4] if len(fields) > 4 else ''
+    clocks = rest.split(None, 2)
+    if len(clocks) >= 2 and clocks[0].isdigit() and clocks[1].isdigit():
+        halfmove, fullmove = clocks[0], clocks[1]
+        rest = clocks[2] if len(clocks) > 2 else ''
+    else:
+        halfmove, fullmove = '0', '1'
+    operations = parse_operations(rest) if rest else {}
+    halfmove = operations.get('hmvc', halfmove)
+    fullmove = operations.get('fmvn', fullmove)
+    return ' '.join(fields[:4]) + ' ' + halfmove + ' ' + fullmove, operations
+
+
+# Generator of (fen, operations) for every position line in the file. Blank lines and '#' comments are skipped.
+def read_positions(path):
+    with open_text(path) as file:
+        for line in file:
+            line = line.strip()
+            if line and line[0] != '#':
+                yield parse_line(line)
+
+
+# Generator of (gamestate, operations). The same GameState is loaded again for every line so nothing piles up,
+# copy what you need before asking for the next position.
+def read_game_states(path, gamestate=None):
+    if gamestate is None:
+        gamestate = ChessEngine.GameState()
+    for fen, operations in read_positions(path):
+        gamestate.load_fen(fen)
+        yield gamestate, operations
+
+
+# EPD line for a GameState or FEN string: 4 position fields, then the operations
+def format_epd(position, operations=None):
+    fen = position if isinstance(position, str) else position.get_fen()
+    line = ' '.join(fen.split()[:4])
+    if operations:
+        line += ' ' + format_operations(operations)
+    return line
+
+
+# items is any iterable, so a generator can be streamed straight to disk. Each item is a GameState, a FEN string,
+# or a (GameState or FEN, operations) pair. epd=False writes full FEN lines with clocks and drops the operations.
+def write_positions(path, items, epd=True):
+    count = 0
+    with open_text(path, 'wt') as file:
+        for item in items:
+            operations = None
+            if isinstance(item, tuple):
+                item, operations = item
+            if epd:
+                line = format_epd(item, operations)
+            else:
+                line = item if isinstance(item, str) else item.get_fen()
+            file.write(line + '\n')
+            count += 1
+    return count
@@ -0,0 +1,198 @@
+# Parallel search on several cores (Lazy SMP). Every helper process runs the normal iterative deepening search on the
+# same position with its own order of root moves, and all of them read and write one transposition table in shared
+# memory, so each helper skips the subtrees the others have already finished. The deepest completed iteration wins.
+# The helpers are started on the first parallel search and kept for the next ones, with their move ordering warm.
+#
+# move, score, depth = ChessParallel.parallel_search(gamestate, limits=ChessAI.SearchLimits(movetime=5), workers=4)
+#
+# workers=1 searches in this process without any sharing, with seed it gives the same move every time.
+
+import os
+import queue
+import random
+import time
+from multiprocessing import Event, Pipe, Process, Queue
+
+import ChessAI
+from ChessTransposition import TranspositionTable, shared_buffer
+
+default_workers = os.cpu_count() or 1
+shared_table = None         # made on first use, kept for the next searches of this process
+helper_pool = None          # HelperPool of this process, made by get_helper_pool
+owner_pid = None            # process the two above belong to
+
+
+# A child made by fork starts with its parent's table and helpers, they are still the parent's to use
+def _forget_inherited():
+    global shared_table, helper_pool, owner_pid
+    if owner_pid != os.getpid():
+        shared_table = None
+        helper_pool = None
+        owner_pid = os.getpid()
+
+
+def get_shared_table(size_mb=None):
+    global shared_table
+    _forget_inherited()
+    if shared_table is None:
+        shared_table = TranspositionTable(buffer=shared_buffer(size_mb or ChessAI.transposition_table_mb))
+    return shared_table
+
+
+# A helper process. Commands come over its pipe one at a time:
+# ('search', search_id, game_class, snapshot, age, (movetime, max_nodes, max_depth), strategy, seed, tablebase_path)
+#   answered on result_queue
+#   with (search_id, index, move_id, score, depth, nodes). Stopped searches answer too, with their last iteration.
+# ('clear',) forgets the move ordering, the table is cleared by whoever owns it
+# ('quit',)
+def _helper(index, connection, table_buffer, stop_event, result_queue):
+    ChessAI.transposition_table = TranspositionTable(buffer=table_buffer)
+    while True:
+        try:
+            command = connection.recv()
+        except EOFError:
+            return
+        if command[0] == 'search':
+            _, search_id, game_class, snapshot, age, budget, strategy, seed, tablebase_path = command
+            ChessAI.transposition_table.age = age
+            if tablebase_path is not None:
+                ChessAI.load_tablebases(tablebase_path)
+            # The helpers start with the same random state, they must not all try the root moves in the same order
+            random.seed(None if seed is None else seed + index)
+            gamestate = game_class.from_snapshot(snapshot)
+            helper_limits = ChessAI.SearchLimits(*budget, stop_event=stop_event)
+            move, score, depth = ChessAI.iterative_deepening(gamestate, None, helper_limits, strategy=strategy,
+                                                             seed=None if seed is None else seed + index)
+            result_queue.put((search_id, index, move.move_id if move is not None else None, score, depth,
+                              helper_limits.nodes))
+        elif command[0] == 'clear':
+            ChessAI.move_ordering.clear()
+        elif command[0] == 'quit':
+            return
+        else:
+            raise ValueError("Unknown helper command " + repr(command[0]))
+
+
+class HelperPool:
+    def __init__(self, workers, table):
+        self.workers = workers
+        self.table = table
+        self.stop_event = Event()
+        self.result_queue = Queue()
+        self.search_id = 0
+        self.connections = []
+        self.processes = []
+        for index in range(workers):
+            connection, helper_connection = Pipe()
+            # Daemons, so a script that never calls close() can still exit
+            process = Process(target=_helper, args=(index, helper_connection, table.table.obj, self.stop_event,
+                                                    self.result_queue), daemon=True)
+            process.start()
+            helper_connection.close()
+            self.connections.append(connection)
+            self.processes.append(process)
+
+    def alive(self):
+        return all(process.is_alive() for process in self.processes)
+
+    # Starts every helper on gamestate, returns the id their answers carry. Only the budget of limits goes over, its
+    # stop_event can not be sent through a pipe.
+    def start(self, gamestate, limits, strategy, seed):
+        self.search_id += 1
+        command = ('search', self.search_id, type(gamestate), gamestate.get_snapshot(), self.table.age,
+                   (limits.movetime, limits.max_nodes, limits.max_depth), strategy, seed,
+                   ChessAI.tablebases.path if ChessAI.tablebases is not None else None)
+        for connection in self.connections:
+            connection.send(command)
+        return self.search_id
+
+    def clear(self):
+        for connection in self.connections:
+            connection.send(('clear',))
+
+    def close(self):
+        self.stop_event.set()
+        for connection in self.connections:
+            try:
+                connection.send(('quit',))
+            except OSError:
+                pass        # that helper is already gone
+        for process in self.processes:
+            process.join()
+        for connection in self.connections:
+            connection.close()
+
+
+# The helpers for workers processes, started once and reused while the count stays the same and none has died
+def get_helper_pool(workers):
+    global helper_pool
+    _forget_inherited()
+    if helper_pool is not None and (helper_pool.workers != workers or not helper_pool.alive()):
+        helper_pool.close()
+        helper_pool = None
+    if helper_pool is None:
+        helper_pool = HelperPool(workers, get_shared_table())
+    return helper_pool
+
+
+# Ends this process's helpers, the next parallel search starts new ones
+def close_helpers():
+    global helper_pool
+    _forget_inherited()
+    if helper_pool is not None:
+        helper_pool.close()
+        helper_pool = None
+
+
+# Between games: empties the shared table and the helpers' move ordering
+def clear():
+    _forget_inherited()
+    if shared_table is not None:
+        shared_table.clear()
+    if helper_pool is not None:
+        helper_pool.clear()
+
+
+# Returns (best move, score, depth) like ChessAI.iterative_deepening. limits is shared out as is: movetime and
+# max_depth hold for the whole search, max_nodes for each helper. As soon as one helper is done, or limits.stop_event
+# is set, the others are stopped and their last completed iterations compared. limits.nodes becomes the total.
+def parallel_search(gamestate, valid_moves=None, limits=None, workers=None, strategy=None, seed=None):
+    if limits is None:
+        limits = ChessAI.SearchLimits()
+    if workers is None:
+        workers = default_workers
+    if valid_moves is None:
+        valid_moves = gamestate.get_valid_moves()
+    if workers <= 1 or len(valid_moves) <= 1:
+        return ChessAI.iterative_deepening(gamestate, valid_moves, limits, strategy=strategy, seed=seed)
+    pool = get_helper_pool(workers)
+    search_id = pool.start(gamestate, limits, strategy, seed)
+    deadline = time.perf_counter() + limits.movetime if limits.movetime is not None else None
+    results = []
+    while len(results) < workers:
+        try:
+            result = pool.result_queue.get(timeout=0.01)
+            if result[0] == search_id:
+                results.append(result)
+        except queue.Empty:
+            if not pool.alive():
+                break       # a helper died without a result, use what the others found
+        if (results or (deadline is not None and time.perf_counter() >= deadline)
+                or (limits.stop_event is not None and limits.stop_event.is_set())):
+            pool.stop_event.set()
+    pool.stop_event.clear()     # every live helper has answered, so none is still looking at it
+    pool.table.new_search()     # the helpers' searches used the next age, keep this process in step
+    if not results:
+        return ChessAI.iterative_deepening(gamestate, valid_moves, ChessAI.SearchLimits(max_depth=1), seed=seed)
+    limits.nodes = sum(result[5] for result in results)
+    # Deepest completed iteration, the lowest helper index on equal depth so the result does not depend on timing
+    _, index, move_id, score, depth, nodes = max(results, key=lambda result: (result[4], -result[1]))
+    for move in valid_moves:
+        if move.move_id == move_id:
+            return move, score, depth
+    return valid_moves[0], score, depth
+
+
+# Same call as the ChessAI finders, for main.py. Bind workers with functools.partial.
+def find_best_move_parallel(gamestate, valid_moves, return_queue, limits=None, workers=None):
+    return_queue.put(parallel_search(gamestate, valid_moves, limits, workers)[0])
@@ -0,0 +1,141 @@
+# Perft (performance test) for the move generators. Counts every leaf of the legal move tree to a fixed depth and
+# compares the totals with the published numbers, which is what catches castling, en passant and promotion bugs.
+# Also prints nodes per second so speedups in get_valid_moves / make_move can be checked without breaking anything.
+#
+# python ChessPerft.py                                   every position below, depth 1 to 3
+# python ChessPerft.py kiwipete --depth 4 --divide       node count per root move on the last depth
+# python ChessPerft.py --fen "<fen>" --depth 3 --hash --processes 4 --bitboards
+
+import argparse
+import time
+from multiprocessing import Pool
+
+import ChessEngine
+import ChessBitboard
+
+# name: (FEN, node counts for depth 1, 2, 3, ...). From https://www.chessprogramming.org/Perft_Results
+positions = {
+    'start': (ChessEngine.start_fen, [20, 400, 8902, 197281, 4865609, 119060324]),
+    'kiwipete': ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+                 [48, 2039, 97862, 4085603, 193690690]),
+    'position3': ("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", [14, 191, 2812, 43238, 674624, 11030083]),
+    'position4': ("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1", [6, 264, 9467, 422333, 15833292]),
+    'position4_mirrored': ("r2q1rk1/pP1p2pp/Q4n2/bbp1p3/Np6/1B3NBn/pPPP1PPP/R3K2R b KQ - 0 1",
+                           [6, 264, 9467, 422333, 15833292]),
+    'position5': ("rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8", [44, 1486, 62379, 2103487, 89941194]),
+    'position6': ("r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+                  [46, 2079, 89890, 3894594, 164075551]),
+}
+
+
+def new_game_state(fen, bitboards=False):
+    return ChessBitboard.BitboardGameState(fen) if bitboards else ChessEngine.GameState(fen)
+
+
+# table is an optional dict of (zobrist key, depth) -> nodes so transposed subtrees are only counted once
+def perft(gamestate, depth, table=None):
+    if depth == 0:
+        return 1
+    if table is not None:
+        key = (gamestate.zobrist_key, depth)
+        if key in table:
+            return table[key]
+    moves = gamestate.get_legal_moves()
+    if depth == 1:      # every legal move is a leaf, no need to make them
+        nodes = len(moves)
+    else:
+        nodes = 0
+        for move in moves:
+            gamestate.make_move(move)
+            nodes += perft(gamestate, depth - 1, table)
+            gamestate.undo_move(False)
+    if table is not None:
+        table[key] = nodes
+    return nodes
+
+
+# Runs in a worker process. Every task rebuilds the root position from its snapshot, pool.map hands a worker several
+# tasks at once and they must not play their moves on top of each other. The move comes over as its packed id.
+def _perft_after_move(args):
+    game_class, snapshot, move_id, depth, use_hash = args
+    gamestate = game_class.from_snapshot(snapshot)
+    gamestate.make_move(ChessEngine.move_from_id(move_id, gamestate.board))
+    return perft(gamestate, depth, {} if use_hash else None)
+
+
+# Node count below each root move, as [(move, nodes)]. processes > 1 splits the root moves over a process pool.
+def divide(gamestate, depth, use_hash=False, processes=1):
+    moves = gamestate.get_legal_moves()
+    if processes > 1:
+        with Pool(processes) as pool:
+            snapshot = gamestate.get_snapshot()
+            counts = pool.map(_perft_after_move, [(type(gamestate), snapshot, move.move_id, depth - 1, use_hash)
+                                                  for move in moves])
+    else:
+        table = {} if use_hash else None
+        counts = []
+        for move in moves:
+            gamestate.make_move(move)
+            counts.append(perft(gamestate, depth - 1, table))
+            gamestate.undo_move(False)
+    return list(zip(moves, counts))
+
+
+# Long algebraic form (e2e4, e7e8n) so divide output can be compared line by line with other engines
+def move_name(move):
+    return move.get_chess_notation() + move.promotion_piece.lower()
+
+
+def run_position(name, fen, expected, depth, use_hash=False, processes=1, show_divide=False, bitboards=False):
+    print(name + ": " + fen)
+    all_passed = True
+    for d in range(1, depth + 1):
+        gamestate = new_game_state(fen, bitboards)
+        start = time.perf_counter()
+        if processes > 1 or (show_divide and d == depth):
+            results = divide(gamestate, d, use_hash, processes)
+            nodes = sum(count for _, count in results)
+        else:
+            results = None
+            nodes = perft(gamestate, d, {} if use_hash else None)
+        elapsed = time.perf_counter() - start
+        if d <= len(expected):
+            passed = nodes == expected[d - 1]
+            status = "ok" if passed else "MISMATCH, expected " + str(expected[d - 1])
+            all_passed = all_passed and passed
+        else:
+            status = "no reference"
+        print("  depth %d: %12d nodes %9.3fs %12.0f nodes/s  %s"
+              % (d, nodes, elapsed, nodes / elapsed if elapsed > 0 else 0, status))
+        if show_divide and d == depth:
+            for move, count in sorted(results, key=lambda result: move_name(result[0])):
+                print("    " + move_name(move) + ": " + str(count))
+    return all_passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Perft node counts and speed for ChessEngine move generation")
+    parser.add_argument('position', nargs='*', help="names from ChessPerft.positions (default: all of them)")
+    parser.add_argument('--fen', help="count a custom position instead")
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--divide', action='store_true', help="node count per root move on the last depth")
+    parser.add_argument('--hash', action='store_true', help="reuse counts of transposed subtrees")
+    parser.add_argument('--processes', type=int, default=1, help="split root moves over this many processes")
+    parser.add_argument('--bitboards', action='store_true',
+                        help="run on the ChessBitboard backend instead of the list board")
+    args = parser.parse_args()
+
+    if args.fen:
+        runs = [('custom', args.fen, [])]
+    else:
+        names = args.position or list(positions)
+        runs = [(name, positions[name][0], positions[name][1]) for name in names]
+    all_passed = True
+    for name, fen, expected in runs:
+        all_passed = run_position(name, fen, expected, args.depth, args.hash, args.processes, args.divide,
+                                  args.bitboards) and all_passed
+    return 0 if all_passed else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,244 @@
+# Streaming PGN reader and game replay. Games are read one at a time, every SAN move is matched against the legal moves
+# and played with GameState.make_move, and one result per game (plies, final FEN, first error) comes out as soon as
+# it is done. Big archives are split into chunks of games over a process pool, with only a few chunks in flight, so
+# memory stays flat however many games the file has.
+#
+# python ChessPgn.py games.pgn.gz --processes 4 > results.tsv
+#
+# for result in ChessPgn.replay_file("games.pgn", processes=4):
+#     if result['error']: print(result['game'], result['error'])
+
+import argparse
+import sys
+from collections import deque
+from multiprocessing import Pool
+
+import ChessEngine
+from ChessFen import open_text
+
+results = ('1-0', '0-1', '1/2-1/2', '*')
+
+
+# Generator of (headers, movetext) per game. Tag lines go into the headers dict, everything else up to the next
+# game's tags is movetext. Lines starting with '%' are escapes and skipped.
+def read_games(path):
+    headers = {}
+    movetext = []
+    with open_text(path) as file:
+        for line in file:
+            line = line.strip()
+            if not line or line[0] == '%':
+                continue
+            if line[0] == '[' and line[-1] == ']' and not _in_comment(movetext):
+                if movetext:
+                    yield headers, '\n'.join(movetext)
+                    headers = {}
+                    movetext = []
+                name, _, value = line[1:-1].partition(' ')
+                headers[name] = value.strip().strip('"').replace('\\"', '"').replace('\\\\', '\\')
+            else:
+                movetext.append(line)
+    if headers or movetext:
+        yield headers, '\n'.join(movetext)
+
+
+# A '[' line inside an open {comment} belongs to the comment, not to the next game
+def _in_comment(movetext):
+    if not movetext:
+        return False
+    text = '\n'.join(movetext)
+    return text.count('{') > text.count('}')
+
+
+# SAN moves of the main line. Comments, variations, NAGs, move numbers and the result are dropped.
+def san_tokens(movetext):
+    tokens = []
+    depth = 0           # inside (variations)
+    i = 0
+    length = len(movetext)
+    while i < length:
+        char = movetext[i]
+        if char == '{':
+            end = movetext.find('}', i)
+            i = length if end == -1 else end + 1
+        elif char == ';':
+            end = movetext.find('\n', i)
+            i = length if end == -1 else end + 1
+        elif char == '(':
+            depth += 1
+            i += 1
+        elif char == ')':
+            depth -= 1
+            i += 1
+        elif char.isspace():
+            i += 1
+        else:
+            start = i
+            while i < length and not movetext[i].isspace() and movetext[i] not in '{};()':
+                i += 1
+            token = movetext[start:i]
+            if depth == 0:
+                token = token.lstrip('0123456789.') if token[0].isdigit() and '.' in token else token
+                if token and token[0] != '$' and token not in results:
+                    tokens.append(token)
+    return tokens
+
+
+# The legal move a SAN string stands for. Accepts check / annotation marks, promotions with or without '=', and
+# castling written with O or 0. Raises ValueError if no legal move or more than one legal move fits.
+def parse_san(gamestate, san, moves=None):
+    if moves is None:
+        moves = gamestate.get_move_set().moves
+    text = san.rstrip('+#!?')
+    if text in ('O-O', '0-0', 'O-O-O', '0-0-0'):
+        king_side = len(text) == 3
+        for move in moves:
+            if move.is_castle_move and (move.end_col == 6) == king_side:
+                return move
+        raise ValueError("Illegal move " + san)
+    promotion = ''
+    if '=' in text:
+        text, _, promotion = text.partition('=')
+    elif len(text) > 2 and text[-1] in 'QRBN':
+        text, promotion = text[:-1], text[-1]
+    kind = 'P'
+    if text and text[0] in 'KQRBN':
+        kind, text = text[0], text[1:]
+    text = text.replace('x', '').replace('-', '').replace(':', '')
+    if len(text) < 2 or text[-2] not in ChessEngine.Move.files_to_cols or text[-1] not in ChessEngine.Move.ranks_to_row:
+        raise ValueError("Bad move " + san)
+    end_col = ChessEngine.Move.files_to_cols[text[-2]]
+    end_row = ChessEngine.Move.ranks_to_row[text[-1]]
+    start_row = start_col = None
+    for char in text[:-2]:      # disambiguation: file, rank or both
+        if char in ChessEngine.Move.files_to_cols:
+            start_col = ChessEngine.Move.files_to_cols[char]
+        elif char in ChessEngine.Move.ranks_to_row:
+            start_row = ChessEngine.Move.ranks_to_row[char]
+        else:
+            raise ValueError("Bad move " + san)
+    match = None
+    for move in moves:
+        if move.end_row == end_row and move.end_col == end_col and move.piece_moved[1] == kind \
+                and move.promotion_piece == promotion and not move.is_castle_move \
+                and (start_col is None or move.start_col == start_col) \
+                and (start_row is None or move.start_row == start_row):
+            if match is not None:
+                raise ValueError("Ambiguous move " + san)
+            match = move
+    if match is None:
+        raise ValueError("Illegal move " + san)
+    return match
+
+
+# Full SAN for a legal move: file / rank disambiguation, promotion piece, capture, and + or # (the move is made and
+# undone to find out).
+def move_to_san(gamestate, move, moves=None):
+    if moves is None:
+        moves = gamestate.get_move_set().moves
+    if move.is_castle_move:
+        san = "O-O" if move.end_col == 6 else "O-O-O"
+    else:
+        end_square = move.get_rank_file(move.end_row, move.end_col)
+        capture = 'x' if move.piece_captured != '--' else ''
+        if move.piece_moved[1] == 'P':
+            san = (move.cols_to_files[move.start_col] + capture if capture else '') + end_square
+            if move.is_pawn_promotion:
+                san += '=' + move.promotion_piece
+        else:
+            others = [other for other in moves if other.piece_moved == move.piece_moved
+                      and other.end_row == move.end_row and other.end_col == move.end_col
+                      and (other.start_row, other.start_col) != (move.start_row, move.start_col)]
+            disambiguation = ''
+            if others:
+                if all(other.start_col != move.start_col for other in others):
+                    disambiguation = move.cols_to_files[move.start_col]
+                elif all(other.start_row != move.start_row for other in others):
+                    disambiguation = move.rows_to_rank[move.start_row]
+                else:
+                    disambiguation = move.get_rank_file(move.start_row, move.start_col)
+            san = move.piece_moved[1] + disambiguation + capture + end_square
+    gamestate.make_move(move)
+    if gamestate.in_check():
+        san += '#' if not gamestate.get_move_set().moves else '+'
+    gamestate.undo_move(False)
+    return san
+
+
+# Replays one game from its start position (the FEN tag if there is one). Stops at the first bad move.
+# Returns {'game', 'plies', 'fen', 'result', 'error'}, error is None when every move was legal.
+def replay_game(headers, movetext, index=0):
+    result = {'game': index, 'plies': 0, 'fen': None, 'result': headers.get('Result', '*'), 'error': None}
+    try:
+        gamestate = ChessEngine.GameState(headers.get('FEN'))
+    except ValueError as error:
+        result['error'] = str(error)
+        return result
+    for san in san_tokens(movetext):
+        try:
+            move = parse_san(gamestate, san)
+        except ValueError as error:
+            result['error'] = "ply " + str(result['plies'] + 1) + ": " + str(error)
+            break
+        gamestate.make_move(move)
+        result['plies'] += 1
+    result['fen'] = gamestate.get_fen()
+    return result
+
+
+# Runs in a worker process, one chunk of (index, headers, movetext) at a time
+def replay_chunk(chunk):
+    return [replay_game(headers, movetext, index) for index, headers, movetext in chunk]
+
+
+def _chunks(path, chunk_size):
+    chunk = []
+    for index, (headers, movetext) in enumerate(read_games(path)):
+        chunk.append((index, headers, movetext))
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# Generator of replay_game results in file order. processes > 1 spreads chunks over a pool, keeping at most two chunks
+# per process queued so the file is never read far ahead of the workers.
+def replay_file(path, processes=1, chunk_size=64):
+    if processes <= 1:
+        for chunk in _chunks(path, chunk_size):
+            for result in replay_chunk(chunk):
+                yield result
+        return
+    with Pool(processes) as pool:
+        pending = deque()
+        for chunk in _chunks(path, chunk_size):
+            pending.append(pool.apply_async(replay_chunk, (chunk,)))
+            if len(pending) >= processes * 2:
+                for result in pending.popleft().get():
+                    yield result
+        while pending:
+            for result in pending.popleft().get():
+                yield result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay every game of a PGN file through ChessEngine")
+    parser.add_argument('path', help="PGN file, .gz is read compressed")
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--chunk', type=int, default=64, help="games per task sent to a worker")
+    args = parser.parse_args()
+
+    games = errors = 0
+    for result in replay_file(args.path, args.processes, args.chunk):
+        games += 1
+        if result['error']:
+            errors += 1
+        print("%d\t%d\t%s\t%s\t%s" % (result['game'], result['plies'], result['result'], result['fen'] or '-',
+                                      result['error'] or ''))
+    print("%d games, %d with errors" % (games, errors), file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
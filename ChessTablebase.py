@@ -0,0 +1,463 @@
+# Endgame tablebases for king and one or two pieces against a lone king (KQK, KRK, KPK, KBNK). The generator works
+# backwards from every checkmate (retrograde analysis) and gives each position its distance to mate in plies, with
+# perfect play on both sides. Tables go into one binary file that is memory mapped for probing, so a probe is an index
+# calculation and one byte read, and processes that open the file share its pages through the OS page cache.
+#
+# python ChessTablebase.py tablebases.ctb KQK KRK KPK KBNK
+#
+# with ChessTablebase.TablebaseFile("tablebases.ctb") as tablebases:
+#     result = tablebases.probe(gamestate)     # (1 win / 0 draw / -1 loss for the side to move, plies to mate)
+#
+# File layout: header (magic, table count), one directory entry per table (signature, offset, positions per side),
+# then per table one byte per position with white to move, then one byte per position with black to move. The strong
+# side is always white in the tables, probes with black as the strong side flip the board. A byte is 0 for a draw (or
+# a position that can not happen), otherwise plies to mate + 1. Only the strong side can ever win.
+#
+# Squares are row * 8 + col like ChessEngine, row 0 being rank 8. Without pawns the white king is moved into the
+# a1-d1-d4 triangle by one of the 8 board symmetries, with a pawn only mirrored onto files a-d.
+
+import argparse
+import mmap
+import struct
+import sys
+import time
+
+from ChessEngine import king_squares, knight_squares, pawn_attack_squares, ray_squares
+
+tablebase_magic = b'CTB1'
+header_struct = struct.Struct('<4sI')
+directory_struct = struct.Struct('<8sQQ')       # signature, data offset, positions per side to move
+signatures = ('KQK', 'KRK', 'KPK', 'KBNK')
+# Promotions are looked up in these tables, so they are built first
+dependencies = {'KPK': ('KQK', 'KRK')}
+max_pieces = 4
+# Material that can never mate, probed as a draw
+drawn_material = ('KK', 'KBK', 'KNK')
+piece_order = 'QRBNP'
+
+
+def _symmetries():
+    maps = []
+    for swap in (False, True):
+        for flip_row in (False, True):
+            for flip_col in (False, True):
+                square_map = []
+                for sq in range(64):
+                    r, c = divmod(sq, 8)
+                    if swap:
+                        r, c = c, r
+                    if flip_row:
+                        r = 7 - r
+                    if flip_col:
+                        c = 7 - c
+                    square_map.append(r * 8 + c)
+                maps.append(tuple(square_map))
+    return maps
+
+
+symmetries = _symmetries()
+identity = symmetries[0]
+mirror_files = symmetries[1]
+mirror_ranks = symmetries[2]
+# a1, b1, c1, d1, b2, c2, d2, c3, d3, d4: file <= 3, rank <= 3, rank <= file (rank = 7 - row)
+triangle_squares = tuple(r * 8 + c for r in range(7, 3, -1) for c in range(4) if 7 - r <= c)
+triangle_index = [-1] * 64
+for _i, _sq in enumerate(triangle_squares):
+    triangle_index[_sq] = _i
+# A white king on the a1-h8 diagonal is in the triangle both as it is and mirrored along that diagonal, so those
+# positions are in the table twice and have to be given their value together
+diagonal_mirror = next(square_map for square_map in symmetries[1:]
+                       if all(square_map[sq] == sq for sq in triangle_squares if 7 - sq // 8 == sq & 7))
+# The symmetry that brings a white king on each square into the triangle
+triangle_map = [next(square_map for square_map in symmetries if triangle_index[square_map[sq]] >= 0)
+                for sq in range(64)]
+half_squares = tuple(r * 8 + c for r in range(8) for c in range(4))
+half_index = [-1] * 64
+for _i, _sq in enumerate(half_squares):
+    half_index[_sq] = _i
+
+king_sets = [frozenset(squares) for squares in king_squares]
+knight_sets = [frozenset(squares) for squares in knight_squares]
+pawn_sets = [frozenset(squares) for squares in pawn_attack_squares['w']]
+
+
+def _lines():
+    between = [[None] * 64 for _ in range(64)]        # bitmask of the squares strictly between, None if not on a line
+    kinds = [[None] * 64 for _ in range(64)]          # 'R' or 'B' for the lines each slider moves along
+    for sq in range(64):
+        for d, ray in enumerate(ray_squares[sq]):
+            mask = 0
+            for target in ray:
+                between[sq][target] = mask
+                kinds[sq][target] = 'R' if d < 4 else 'B'
+                mask |= 1 << target
+    return between, kinds
+
+
+line_between, line_kinds = _lines()
+
+
+# Material of a table, white pieces besides the king in signature order: 'KBNK' -> ('B', 'N')
+def table_pieces(signature):
+    if signature not in signatures:
+        raise ValueError("No tablebase for " + signature + ", known are " + ', '.join(signatures))
+    return tuple(signature[1:-1])
+
+
+# Works out the square layout and index arithmetic of one table
+class TableLayout:
+    def __init__(self, signature):
+        self.signature = signature
+        self.pieces = table_pieces(signature)
+        self.has_pawn = 'P' in self.pieces
+        self.king_squares = half_squares if self.has_pawn else triangle_squares
+        self.king_index = half_index if self.has_pawn else triangle_index
+        self.size = len(self.king_squares) * 64 ** (len(self.pieces) + 1)
+
+    # Square map that puts the white king where the table keeps it
+    def canonical_map(self, white_king):
+        if self.has_pawn:
+            return identity if white_king & 7 < 4 else mirror_files
+        return triangle_map[white_king]
+
+    # squares: white king, the pieces in signature order, black king. Already canonical.
+    def index(self, squares):
+        index = self.king_index[squares[0]]
+        for sq in squares[1:]:
+            index = index * 64 + sq
+        return index
+
+    def canonical_index(self, squares):
+        square_map = self.canonical_map(squares[0])
+        return self.index([square_map[sq] for sq in squares])
+
+    # The same position's other index when the white king is on the diagonal, else None
+    def twin(self, index):
+        squares = self.squares(index)
+        if self.has_pawn or 7 - squares[0] // 8 != squares[0] & 7:
+            return None
+        twin = self.index([diagonal_mirror[sq] for sq in squares])
+        return twin if twin != index else None
+
+    def squares(self, index):
+        squares = []
+        for _ in range(len(self.pieces) + 1):
+            index, sq = divmod(index, 64)
+            squares.append(sq)
+        squares.append(self.king_squares[index])
+        squares.reverse()
+        return squares
+
+
+# Is target attacked by the white king or pieces ((kind, square), ...) with the given occupied bitmask
+def white_attacks(target, white_king, pieces, occupied):
+    if target in king_sets[white_king]:
+        return True
+    for kind, sq in pieces:
+        if kind == 'N':
+            if target in knight_sets[sq]:
+                return True
+        elif kind == 'P':
+            if target in pawn_sets[sq]:
+                return True
+        else:
+            line = line_kinds[sq][target]
+            if line is not None and (kind == 'Q' or kind == line) and not line_between[sq][target] & occupied:
+                return True
+    return False
+
+
+# Board state of a table position: None if it can not happen (two pieces on a square, kings touching, a pawn on
+# the first or last rank), else (pieces, occupied bitmask)
+def position_pieces(layout, squares):
+    white_king, black_king = squares[0], squares[-1]
+    if black_king in king_sets[white_king] or len(set(squares)) != len(squares):
+        return None
+    pieces = tuple(zip(layout.pieces, squares[1:-1]))
+    for kind, sq in pieces:
+        if kind == 'P' and not 8 <= sq < 56:
+            return None
+    occupied = 0
+    for sq in squares:
+        occupied |= 1 << sq
+    return pieces, occupied
+
+
+class Tablebase:
+    def __init__(self, signature, white_to_move=None, black_to_move=None):
+        self.layout = TableLayout(signature)
+        self.signature = signature
+        self.white_to_move = white_to_move if white_to_move is not None else bytearray(self.layout.size)
+        self.black_to_move = black_to_move if black_to_move is not None else bytearray(self.layout.size)
+
+    # Builds the table. Black to move positions count the king moves that stay in the table; a capture or a
+    # stalemate is a draw, a mate starts the search. Then, closest mates first, every lost black position makes the
+    # white positions one move before it won, and a black position is lost once all its moves lead to won positions.
+    # built holds finished tables for promotions.
+    def generate(self, built=None, progress=None):
+        layout = self.layout
+        size = layout.size
+        remaining = bytearray(size)         # black moves not yet known to lose, 255 when black can hold the draw
+        buckets = [[]]
+        for index in range(size):
+            squares = layout.squares(index)
+            state = position_pieces(layout, squares)
+            if state is None:
+                remaining[index] = 255
+                continue
+            pieces, occupied = state
+            white_king, black_king = squares[0], squares[-1]
+            without_king = occupied & ~(1 << black_king)
+            moves = 0
+            escape = False
+            for target in king_sets[black_king]:
+                if target == white_king or target in king_sets[white_king]:
+                    continue
+                if without_king >> target & 1:     # takes a white piece, the rest must not cover the square
+                    others = tuple(piece for piece in pieces if piece[1] != target)
+                    if not white_attacks(target, white_king, others, without_king & ~(1 << target)):
+                        escape = True
+                        break
+                elif not white_attacks(target, white_king, pieces, without_king):
+                    moves += 1
+            if escape:
+                remaining[index] = 255
+            elif moves:
+                remaining[index] = moves
+            elif white_attacks(black_king, white_king, pieces, occupied):
+                buckets[0].append(index)        # checkmated
+            else:
+                remaining[index] = 255          # stalemate
+            if layout.has_pawn and built is not None:
+                self.promotion_wins(squares, pieces, occupied, index, built, buckets)
+            if progress is not None and index % 500000 == 0:
+                progress("%s: %d of %d positions set up" % (self.signature, index, size))
+        depth = 0
+        while depth < len(buckets):
+            for index in buckets[depth]:       # twins are added to the list while it is walked
+                if depth & 1:
+                    if self.white_to_move[index]:
+                        continue
+                    self.white_to_move[index] = depth + 1
+                    twin = layout.twin(index)
+                    if twin is not None and not self.white_to_move[twin]:
+                        buckets[depth].append(twin)
+                    for previous in self.black_predecessors(index):
+                        if remaining[previous] != 255 and remaining[previous]:
+                            remaining[previous] -= 1
+                            if not remaining[previous]:
+                                self.push(buckets, depth + 1, previous)
+                else:
+                    if self.black_to_move[index]:
+                        continue
+                    self.black_to_move[index] = depth + 1
+                    twin = layout.twin(index)
+                    if twin is not None and not self.black_to_move[twin]:
+                        buckets[depth].append(twin)
+                    for previous in self.white_predecessors(index):
+                        if not self.white_to_move[previous]:
+                            self.push(buckets, depth + 1, previous)
+            buckets[depth] = None
+            if progress is not None and depth % 10 == 0:
+                progress("%s: mates in %d plies done" % (self.signature, depth))
+            depth += 1
+        return self
+
+    @staticmethod
+    def push(buckets, depth, index):
+        while len(buckets) <= depth:
+            buckets.append([])
+        buckets[depth].append(index)
+
+    # White to move with a pawn on the 7th: pushing it to a queen or rook wins when that table says so
+    def promotion_wins(self, squares, pieces, occupied, index, built, buckets):
+        white_king, black_king = squares[0], squares[-1]
+        pawn = squares[1]
+        if pawn >= 16 or occupied >> (pawn - 8) & 1 or white_attacks(black_king, white_king, pieces, occupied):
+            return
+        best = 0
+        for kind in ('Q', 'R'):
+            table = built.get('K' + kind + 'K')
+            if table is None:
+                continue
+            value = table.black_to_move[table.layout.canonical_index([white_king, pawn - 8, black_king])]
+            if value and (not best or value < best):
+                best = value
+        if best:
+            self.push(buckets, best, index)     # lost in best - 1 plies after the promotion, one more for it
+
+    # White to move positions with a white move into black to move position index
+    def white_predecessors(self, index):
+        layout = self.layout
+        squares = layout.squares(index)
+        pieces, occupied = position_pieces(layout, squares)
+        black_king = squares[-1]
+        previous = []
+        for i in range(len(squares) - 1):
+            sq = squares[i]
+            kind = 'K' if i == 0 else layout.pieces[i - 1]
+            if kind == 'K':
+                origins = [target for target in king_sets[sq]
+                           if not occupied >> target & 1 and target not in king_sets[black_king]]
+            elif kind == 'N':
+                origins = [target for target in knight_sets[sq] if not occupied >> target & 1]
+            elif kind == 'P':
+                origins = []
+                if sq < 48 and not occupied >> (sq + 8) & 1:
+                    origins.append(sq + 8)
+                    if 32 <= sq < 40 and not occupied >> (sq + 16) & 1:
+                        origins.append(sq + 16)
+            else:
+                origins = []
+                for d in (range(4) if kind == 'R' else range(4, 8) if kind == 'B' else range(8)):
+                    for target in ray_squares[sq][d]:
+                        if occupied >> target & 1:
+                            break
+                        origins.append(target)
+            for origin in origins:
+                before = squares[:]
+                before[i] = origin
+                before_pieces = tuple(zip(layout.pieces, before[1:-1]))
+                before_occupied = occupied & ~(1 << sq) | 1 << origin
+                if white_attacks(black_king, before[0], before_pieces, before_occupied):
+                    continue            # black would have been in check with white to move
+                if i == 0 and layout.king_index[origin] < 0:
+                    previous.append(layout.canonical_index(before))
+                else:
+                    previous.append(layout.index(before))
+        return previous
+
+    # Black to move positions with a black king move into white to move position index
+    def black_predecessors(self, index):
+        layout = self.layout
+        squares = layout.squares(index)
+        white_king, black_king = squares[0], squares[-1]
+        occupied = 0
+        for sq in squares:
+            occupied |= 1 << sq
+        previous = []
+        base = index - black_king
+        for origin in king_sets[black_king]:
+            if not occupied >> origin & 1 and origin not in king_sets[white_king]:
+                previous.append(base + origin)
+        return previous
+
+
+def generate_tables(names, progress=None):
+    built = {}
+    for name in names:
+        for needed in dependencies.get(name, ()) + (name,):
+            if needed not in built:
+                built[needed] = Tablebase(needed).generate(built, progress)
+    return built
+
+
+def write_tables(path, tables):
+    tables = list(tables)
+    offset = header_struct.size + directory_struct.size * len(tables)
+    with open(path, 'wb') as file:
+        file.write(header_struct.pack(tablebase_magic, len(tables)))
+        for table in tables:
+            file.write(directory_struct.pack(table.signature.encode('ascii'), offset, table.layout.size))
+            offset += table.layout.size * 2
+        for table in tables:
+            file.write(table.white_to_move)
+            file.write(table.black_to_move)
+
+
+# Strong side, signature and squares (white king, pieces in signature order, black king) of a GameState, with the
+# board flipped when black is the strong side, or None if the material is not one strong side against a lone king
+def material(gamestate):
+    if gamestate.piece_count() > max_pieces:
+        return None
+    found = {'w': [], 'b': []}
+    for color in 'wb':
+        for kind in 'PNBRQK':
+            for sq in gamestate.squares_of(color + kind):
+                found[color].append((kind, sq))
+    if len(found['b']) == 1:
+        strong, weak = 'w', 'b'
+    elif len(found['w']) == 1:
+        strong, weak = 'b', 'w'
+    else:
+        return None
+    pieces = sorted((piece for piece in found[strong] if piece[0] != 'K'),
+                    key=lambda piece: piece_order.index(piece[0]))
+    signature = 'K' + ''.join(kind for kind, _ in pieces) + 'K'
+    square_map = identity if strong == 'w' else mirror_ranks
+    squares = ([square_map[sq] for kind, sq in found[strong] if kind == 'K'] + [square_map[sq] for _, sq in pieces]
+               + [square_map[found[weak][0][1]]])
+    return strong, signature, squares
+
+
+class TablebaseFile:
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count = header_struct.unpack_from(self.map, 0)
+        if magic != tablebase_magic:
+            raise ValueError("Not a tablebase file: " + str(path))
+        self.tables = {}
+        for i in range(count):
+            name, offset, size = directory_struct.unpack_from(self.map, header_struct.size + i * directory_struct.size)
+            signature = name.rstrip(b'\0').decode('ascii')
+            self.tables[signature] = (TableLayout(signature), offset, size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.map.close()
+
+    # (1, plies) if the side to move mates in that many plies, (-1, plies) if it is mated in that many (0 is mated
+    # now), (0, 0) for a draw. None if the position is not in the file. Castling rights and the 50 move rule are not
+    # looked at.
+    def probe(self, gamestate):
+        found = material(gamestate)
+        if found is None:
+            return None
+        strong, signature, squares = found
+        if signature in drawn_material:
+            return 0, 0
+        table = self.tables.get(signature)
+        if table is None:
+            return None
+        layout, offset, size = table
+        strong_to_move = gamestate.white_to_move == (strong == 'w')
+        value = self.map[offset + (0 if strong_to_move else size) + layout.canonical_index(squares)]
+        if not value:
+            return 0, 0
+        return (1, value - 1) if strong_to_move else (-1, value - 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate endgame tablebases into one file")
+    parser.add_argument('path', help="file to write, e.g. tablebases.ctb")
+    parser.add_argument('tables', nargs='*', default=list(signatures), help="tables to build, default all of "
+                        + ', '.join(signatures))
+    args = parser.parse_args()
+    start = time.perf_counter()
+
+    def progress(text):
+        print("%7.1fs  %s" % (time.perf_counter() - start, text), file=sys.stderr)
+
+    try:
+        tables = generate_tables(args.tables, progress)
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return 1
+    write_tables(args.path, tables.values())
+    for signature, table in tables.items():
+        wins = sum(1 for value in table.white_to_move if value)
+        longest = max(table.white_to_move)
+        print("%s: %d positions per side, %d won with white to move, longest mate %d plies"
+              % (signature, table.layout.size, wins, longest - 1 if longest else 0))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,102 @@
+# Fixed size transposition table for the search. Entries are two 64 bit words in one flat array('Q'), the zobrist key
+# and a packed data word, so the memory use is set once by the MB budget and never grows during a search.
+# The words can also live in a shared memory buffer (shared_buffer) so several search processes fill one table.
+# The first word is stored as key ^ data, so an entry half written by another process just fails the key check.
+#
+# table = ChessTransposition.TranspositionTable(size_mb=16)
+# table.store(gamestate.zobrist_key, depth, ChessTransposition.exact, score, move.move_id)
+# entry = table.probe(gamestate.zobrist_key)      # (depth, bound, score, move_id) or None
+
+import ctypes
+from array import array
+from multiprocessing import RawArray
+
+# Bound of a stored score: exact, at least the score (fail high / cutoff) or at most the score (fail low)
+exact = 1
+lower_bound = 2
+upper_bound = 3
+
+# Data word: bits 0-16 move id (0 for none), 17-37 score + score_offset, 38-45 depth, 46-47 bound, 48-55 age
+score_shift = 17
+score_offset = 1 << 20
+depth_shift = 38
+bound_shift = 46
+age_shift = 48
+entry_bytes = 16
+
+
+# Entries for an MB budget, rounded down to a power of two so the slot is key & mask
+def entry_count(size_mb):
+    if size_mb <= 0:
+        raise ValueError("Transposition table size must be positive, got " + str(size_mb))
+    count = 1
+    while count * 2 * entry_bytes <= size_mb * (1 << 20):
+        count *= 2
+    return count
+
+
+# Zeroed shared memory for TranspositionTable(buffer=...). Hand it to worker processes as a Process argument.
+def shared_buffer(size_mb):
+    return RawArray(ctypes.c_uint64, entry_count(size_mb) * 2)
+
+
+class TranspositionTable:
+    def __init__(self, size_mb=16, buffer=None):
+        if buffer is None:
+            self.resize(size_mb)
+        else:
+            self.table = memoryview(buffer).cast('B').cast('Q')
+            self.mask = len(self.table) // 2 - 1
+            self.size_mb = len(self.table) * 8 / (1 << 20)
+            self.age = 0
+
+    # Drops everything stored
+    def resize(self, size_mb):
+        self.size_mb = size_mb
+        self.mask = entry_count(size_mb) - 1
+        self.table = array('Q', bytes((self.mask + 1) * entry_bytes))
+        self.age = 0
+
+    # Between games. Old entries would still be correct, but they take slots from the new game's positions.
+    # Zeroed in place, a shared table is cleared for every process using it.
+    def clear(self):
+        self.table[:] = array('Q', bytes(len(self.table) * 8))
+        self.age = 0
+
+    # Once per move searched, so entries from earlier searches are the first to be replaced
+    def new_search(self):
+        self.age = (self.age + 1) & 0xFF
+
+    def probe(self, key):
+        index = (key & self.mask) << 1
+        data = self.table[index + 1]
+        if not data or self.table[index] ^ data != key:
+            return None
+        return (data >> depth_shift & 0xFF, data >> bound_shift & 3,
+                (data >> score_shift & 0x1FFFFF) - score_offset, data & 0x1FFFF)
+
+    # One slot per key. A different position is replaced when it is from an older search or was not searched deeper,
+    # the same position is always updated, keeping its old best move if this search did not find one.
+    def store(self, key, depth, bound, score, move_id=0):
+        index = (key & self.mask) << 1
+        table = self.table
+        data = table[index + 1]
+        if table[index] ^ data == key:
+            if not move_id:
+                move_id = data & 0x1FFFF
+        elif data and data >> age_shift == self.age and data >> depth_shift & 0xFF > depth:
+            return
+        data = (move_id | (score + score_offset) << score_shift | depth << depth_shift
+                | bound << bound_shift | self.age << age_shift)
+        table[index] = key ^ data
+        table[index + 1] = data
+
+    # Share of slots holding an entry from the current search, per thousand like UCI hashfull
+    def usage(self, sample=1000):
+        sample = min(sample, self.mask + 1)
+        used = 0
+        for i in range(sample):
+            data = self.table[i * 2 + 1]
+            if data and data >> age_shift == self.age:
+                used += 1
+        return used * 1000 // sample
@@ -0,0 +1,128 @@
+# Long lived AI process for the game. It is started once and gets its work over a pipe, so the AI modules are only
+# imported once and the transposition table, move ordering history, opening book and tablebase maps stay warm from
+# one move to the next. With a ChessParallel finder the Lazy SMP helper processes live inside the worker and are kept
+# between moves too. A search is cancelled through a shared Event the search itself looks at, never by terminating
+# the process.
+#
+# worker = ChessWorker.EngineWorker(book_path="book.bin", tablebase_path="tablebases.ctb")
+# worker.search(ChessAI.find_best_move_minimax, gamestate, ChessAI.SearchLimits(movetime=2))    # returns at once
+# if worker.ready():
+#     move = worker.move(gamestate.get_valid_moves())     # None if the search had nothing
+# worker.stop()       # drops the running search, its move never comes back
+# worker.clear()      # new game, forget everything learnt
+# worker.close()
+
+import queue
+from multiprocessing import Event, Pipe, Process, util
+
+import ChessAI
+import ChessParallel
+
+
+# The worker process. Commands come one at a time:
+# ('search', search_id, finder, game_class, snapshot, limits) answered with (search_id, move_id or None)
+# ('stop',) sent after the stop event was set. Every search before it has seen the event, so it is cleared here
+#           and the next search starts with a fresh one.
+# ('clear',) empties the transposition tables and move ordering
+# ('quit',) also ends ChessParallel's helpers
+def _serve(connection, stop_event, book_path, tablebase_path):
+    while True:
+        try:
+            command = connection.recv()
+        except EOFError:
+            return          # the game went away without saying quit
+        if command[0] == 'search':
+            _, search_id, finder, game_class, snapshot, limits = command
+            if limits is None:
+                limits = ChessAI.SearchLimits()
+            limits.stop_event = stop_event
+            answer = queue.SimpleQueue()
+            ChessAI.find_move_from_snapshot(finder, game_class, snapshot, answer, limits, book_path, tablebase_path)
+            move = answer.get()
+            connection.send((search_id, move.move_id if move is not None else None))
+        elif command[0] == 'stop':
+            stop_event.clear()
+        elif command[0] == 'clear':
+            if ChessAI.transposition_table is not None:
+                ChessAI.transposition_table.clear()
+            ChessAI.move_ordering.clear()
+            ChessParallel.clear()
+        elif command[0] == 'quit':
+            ChessParallel.close_helpers()
+            return
+        else:
+            raise ValueError("Unknown worker command " + repr(command[0]))
+
+
+# Ends the worker after whatever it is doing. Also run when the game exits without close(), before multiprocessing
+# waits for its child processes, which would otherwise wait forever for the worker.
+def _shutdown(connection, stop_event, process):
+    stop_event.set()
+    try:
+        connection.send(('quit',))
+    except OSError:
+        pass            # the worker is already gone
+    process.join()
+    connection.close()
+
+
+class EngineWorker:
+    def __init__(self, book_path=None, tablebase_path=None):
+        self.connection, worker_connection = Pipe()
+        self.stop_event = Event()
+        # Not a daemon: a finder from ChessParallel starts processes of its own
+        self.process = Process(target=_serve, args=(worker_connection, self.stop_event, book_path, tablebase_path))
+        self.process.start()
+        worker_connection.close()
+        self.finalizer = util.Finalize(self, _shutdown, args=(self.connection, self.stop_event, self.process),
+                                       exitpriority=10)
+        self.search_id = 0
+        self.thinking = False
+        self.move_id = None
+
+    # Starts finder (a ChessAI finder, or ChessParallel's bound with functools.partial) on gamestate and returns at
+    # once. Only a snapshot of the position goes over. A search still running is stopped first.
+    def search(self, finder, gamestate, limits=None):
+        self.stop()
+        self.search_id += 1
+        self.thinking = True
+        self.move_id = None
+        self.connection.send(('search', self.search_id, finder, type(gamestate), gamestate.get_snapshot(), limits))
+
+    # True once the last search has answered. Answers of stopped searches are read here and thrown away.
+    def ready(self):
+        while self.thinking and self.connection.poll():
+            search_id, move_id = self.connection.recv()
+            if search_id == self.search_id:
+                self.thinking = False
+                self.move_id = move_id
+        return not self.thinking
+
+    # The answered move out of valid_moves (the same position's moves), None if the search found none
+    def move(self, valid_moves):
+        for move in valid_moves:
+            if move.move_id == self.move_id:
+                return move
+        return None
+
+    # The running search winds down at its next budget check, its move is never returned
+    def stop(self):
+        if self.thinking:
+            self.stop_event.set()
+            self.connection.send(('stop',))
+            self.thinking = False
+
+    # Between games
+    def clear(self):
+        self.stop()
+        self.connection.send(('clear',))
+
+    def close(self):
+        self.thinking = False
+        self.finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -2,8 +2,12 @@
 
 import pygame as p
 import ChessEngine
+import ChessBitboard
 import ChessAI
-from multiprocessing import Process, Queue
+import ChessParallel
+import ChessWorker
+import os
+from functools import partial
 import random
 # Using multiprocessing because we are handling more heavy computations (Game of Chess!)
 # while threads are better for unsure about time and not heavy computations
@@ -17,22 +21,27 @@ move_log_panel_height = board_height
 dimension = 8
 sq_size = board_height // dimension   # to make sure it is an int. //
 images = {}
+ai_movetime = 2.0       # seconds the AI may think per move
+ai_workers = 1          # search processes per AI move, more than 1 searches in parallel (ChessParallel)
+book_path = "book.bin"  # Polyglot opening book the AI plays from while the game is in it, ignored if missing
+tablebase_path = "tablebases.ctb"   # endgame tablebases from ChessTablebase.py, ignored if missing
+use_bitboards = False   # True to run the game and the AI on the ChessBitboard backend
 """
 Future to do list
 - Change game state creation so it only updates moves that has changed 
     so it does not need to update entire board each time
-- Fix undo causing out of range error. I believe this has to do with the process of how log is saved not the fake moves
 - Try making the play state asynch. Aka thread and make the ui unresponsive if AI is taking turn
 - Maybe refactor Engine code by making it more based on gamestate than individual stuff
 - Allow checking for white and black's moves so you can click and see both sides moves. 
-- Thinking Queue is also doing p.init() repeatedly so maybe fix that
-- For Fun: ChessAI. Try making transposition tables or known opening positions with maybe a database 
-    Maybe End-game logic. When certain amount of pieces have been removed. 
 - Add the eval to maybe the bottom or left side of the screen. 
 
 """
 
 
+def new_game_state():
+    return ChessBitboard.BitboardGameState() if use_bitboards else ChessEngine.GameState()
+
+
 # Initialize global directory of images
 def load_images():
     pieces = ['bP', 'bQ', 'bN', 'bK', 'bR', 'bB', 'wP', 'wQ', 'wN', 'wK', 'wR', 'wB']
@@ -46,8 +55,9 @@ def main():
     clock = p.time.Clock()
     screen.fill(p.Color("white"))
     move_log_font = p.font.SysFont("Ariel", 14, False, False)
-    gamestate = ChessEngine.GameState()
+    gamestate = new_game_state()
     valid_moves = gamestate.get_valid_moves()
+    move_set = gamestate.get_move_set()     # same moves, indexed by square for clicks and highlighting
     move_made = False   # Flag variable for move.
     animate = False     # Flag variable for move. Also future potential for options
 
@@ -60,7 +70,9 @@ def main():
     player_two = False  # Same as above but for black
 
     AI_thinking = False         # For AI threading
-    move_process = None
+    # One AI process for the whole game, it keeps its tables between moves
+    worker = ChessWorker.EngineWorker(book_path if os.path.isfile(book_path) else None,
+                                      tablebase_path if os.path.isfile(tablebase_path) else None)
     move_undone = False
     while playing:
         human_turn = (gamestate.white_to_move and player_one) or (not gamestate.white_to_move and player_two)
@@ -80,18 +92,18 @@ def main():
                         selected_sq = (row, col)
                         player_clicks.append(selected_sq)
                     if len(player_clicks) == 2 and human_turn:     # after 2nd click
-                        move = ChessEngine.Move(player_clicks[0], player_clicks[1], gamestate.board)
-                        for i in range(len(valid_moves)):
-                            # Pawn promotion is here instead of engine because I am inefficient and 'fake check' moves.
-                            if move == valid_moves[i]:
-                                gamestate.make_move(valid_moves[i])
-                                move_made = True
-                                animate = True
-
-                                # reset
-                                selected_sq = ()
-                                player_clicks = []
-                                gamestate.move_redo_stack = []
+                        # Clicks carry no flags, so look up by squares and let the generated move supply them.
+                        move = move_set.find(player_clicks[0][0], player_clicks[0][1],
+                                             player_clicks[1][0], player_clicks[1][1])
+                        if move is not None:
+                            gamestate.make_move(move)
+                            move_made = True
+                            animate = True
+
+                            # reset
+                            selected_sq = ()
+                            player_clicks = []
+                            gamestate.move_redo_stack = []
                         if not move_made:
                             player_clicks = [selected_sq]
             elif e.type == p.KEYDOWN:
@@ -101,7 +113,7 @@ def main():
                     animate = False
                     game_over = False
                     if AI_thinking:
-                        move_process.terminate()
+                        worker.stop()       # the search winds down by itself, its move is never read
                         AI_thinking = False
                     move_undone = True
                 if e.key == p.K_r:  # redo when r is pressed
@@ -109,20 +121,22 @@ def main():
                     gamestate.redo_move()
                     animate = False
                     if AI_thinking:
-                        move_process.terminate()
+                        worker.stop()       # the search winds down by itself, its move is never read
                         AI_thinking = False
                     move_undone = True
 
                 if e.key == p.K_MINUS:  # reset when - is pressed
-                    gamestate = ChessEngine.GameState()
+                    gamestate = new_game_state()
                     valid_moves = gamestate.get_valid_moves()
+                    move_set = gamestate.get_move_set()
+                    worker.clear()
                     selected_sq = ()
                     player_clicks = []
                     game_over = False
                     move_made = False
                     animate = False
                     if AI_thinking:
-                        move_process.terminate()
+                        worker.stop()       # the search winds down by itself, its move is never read
                         AI_thinking = False
                     move_undone = True
 
@@ -130,21 +144,17 @@ def main():
         if not game_over and not human_turn and not move_undone:
             if not AI_thinking:
                 AI_thinking = True
-                # using Queue because larger computations. Passing data between threads
-                return_queue = Queue()
-                if random.randint(0, 9) > 3:
-                    move_process = Process(target=ChessAI.find_best_move_minimax,
-                                           args=(gamestate, valid_moves, return_queue))
-                else:
-                    move_process = Process(target=ChessAI.find_best_move, args=(gamestate, valid_moves, return_queue))
-                move_process.start()    # Calling the target. find_best_move(gamestate, valid_moves, return_queue)
-                # is thread alive
-            if not move_process.is_alive():
-                # return_queue still works. Different thread.
-                AI_move = return_queue.get()
+                finder = ChessAI.find_best_move_minimax if random.randint(0, 9) > 3 else ChessAI.find_best_move
+                if finder is ChessAI.find_best_move_minimax and ai_workers > 1:
+                    finder = partial(ChessParallel.find_best_move_parallel, workers=ai_workers)
+                # Only a small snapshot of the position goes to the worker, not the whole game
+                worker.search(finder, gamestate, ChessAI.SearchLimits(movetime=ai_movetime))
+            if worker.ready():
+                AI_move = worker.move(valid_moves)
                 if AI_move is None:
                     AI_move = ChessAI.find_random_move(valid_moves)
                 gamestate.make_move(AI_move)
+                gamestate.move_redo_stack = []     # redo is only valid along the line that was undone
                 move_made = True
                 animate = True
                 AI_thinking = False
@@ -153,11 +163,12 @@ def main():
             if animate:
                 animations(gamestate.move_log[-1], screen, gamestate.board, clock)
             valid_moves = gamestate.get_valid_moves()
+            move_set = gamestate.get_move_set()
             move_made = False
             animate = False
             move_undone = False
 
-        create_game_state(screen, gamestate, valid_moves, selected_sq, move_log_font)
+        create_game_state(screen, gamestate, move_set, selected_sq, move_log_font)
 
         if gamestate.checkmate or gamestate.stalemate:
             game_over = True
@@ -166,11 +177,17 @@ def main():
                 text = "Black wins by checkmate" if gamestate.white_to_move else "White wins by checkmate"
                 color = "Black" if gamestate.white_to_move else "White"
             else:
-                text = "Stalemate by repeat" if gamestate.stalemate_by_repeat else "Stalemate"
+                if gamestate.stalemate_by_repeat:
+                    text = "Stalemate by repeat"
+                elif gamestate.stalemate_by_fifty_moves:
+                    text = "Stalemate by 50 move rule"
+                else:
+                    text = "Stalemate"
             create_text(screen, text, color)
 
         clock.tick(max_fps)
         p.display.flip()
+    worker.close()
 
 
 # highlight when in check
@@ -189,7 +206,7 @@ def highlight_in_check(game_state, screen):
 
 
 # highlight selected square and show possible moves
-def highlight_squares(gamestate, screen, valid_moves, selected_sq):
+def highlight_squares(gamestate, screen, move_set, selected_sq):
     if selected_sq != ():
         r, c = selected_sq
         # highlighting selected square
@@ -202,14 +219,13 @@ def highlight_squares(gamestate, screen, valid_moves, selected_sq):
             # highlight moves from that square
             s.set_alpha(200)
             s.fill(p.Color("Orchid"))
-            for move in valid_moves:
-                if move.start_row == r and move.start_col == c:
-                    screen.blit(s, (move.end_col * sq_size, move.end_row * sq_size))
+            for move in move_set.from_square(r, c):
+                screen.blit(s, (move.end_col * sq_size, move.end_row * sq_size))
 
 
-def create_game_state(screen, gamestate, valid_moves, selected_sq, move_log_font):
+def create_game_state(screen, gamestate, move_set, selected_sq, move_log_font):
     create_board(screen)  # draw squares then drawing pieces. Board should come first
-    highlight_squares(gamestate, screen, valid_moves, selected_sq)
+    highlight_squares(gamestate, screen, move_set, selected_sq)
     highlight_in_check(gamestate, screen)
     create_piece(screen, gamestate.board)
     create_move_log(screen, gamestate, move_log_font)